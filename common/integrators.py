@@ -2,7 +2,7 @@ import numpy
 import functools
 
 from common import GRID
-from common import orthopoly
+from common import orthopoly, utils
 
 
 def euler_correction(y, t, f, h):
@@ -73,16 +73,6 @@ ADAMS_BASHFORTH_COEFFICIENTS = {
     5: ([251., -1274., 2616., -2774., 1901.], 720.)
 }
 
-
-def adams_bashforth_correction(fs, h, order=None):
-    if order is None:
-        order = min(len(ADAMS_BASHFORTH_COEFFICIENTS), len(fs))
-
-    bs, divider = ADAMS_BASHFORTH_COEFFICIENTS[order]
-
-    return h * sum(b * f for b, f in zip(bs, fs[-order:])) / divider
-
-
 ADAMS_MOULTON_COEFFICIENTS = {
     1: ([1.], 1.),
     2: ([1., 1.], 2.),
@@ -91,18 +81,288 @@ ADAMS_MOULTON_COEFFICIENTS = {
     5: ([-19., 106., -264., 646., 251.], 720.)
 }
 
+# Normalized weights of the derivatives for the equally spaced history, the most recent last
+ADAMS_BASHFORTH_WEIGHTS = {order: numpy.array(bs) / divider
+                           for order, (bs, divider) in ADAMS_BASHFORTH_COEFFICIENTS.items()}
+ADAMS_MOULTON_WEIGHTS = {order: numpy.array(bs) / divider
+                         for order, (bs, divider) in ADAMS_MOULTON_COEFFICIENTS.items()}
+
+
+def adams_weights(nodes, h):
+    """
+    Weights $w_j$ of the derivatives $f_j = f(t + \tau_j h)$ such that
+
+    \begin{equation}
+        \int_t^{t+h} f(t') dt' \approx h \sum_j w_j f_j
+    \end{equation}
+
+    is exact for polynomials of the degree below the number of `nodes` $t_j = \tau_j h$ (relative\
+    to the current point $t$). For the equally spaced nodes these are the Adams-Bashforth and\
+    Adams-Moulton coefficients.
+    """
+    tau = numpy.asarray(nodes, dtype=float) / h
+    powers = numpy.arange(len(tau))
+    return numpy.linalg.solve(tau[numpy.newaxis, :] ** powers[:, numpy.newaxis], 1. / (powers + 1))
+
+
+def history_nodes(steps, count):
+    """ Points of the last `count` derivatives of the history relative to the last one given\
+        the step sizes `steps` between the consecutive derivatives of the history """
+    steps = numpy.asarray(steps, dtype=float)[len(steps) - count + 1:] if count > 1 else []
+    return -numpy.concatenate([numpy.cumsum(steps[::-1])[::-1], [0.]])
+
+
+def uniform(steps, h):
+    return steps is None or numpy.all(numpy.asarray(steps) == h)
+
+
+def adams_bashforth_weights(order, h, steps=None):
+    """ Weights of the last `order` derivatives, the step sizes `steps` between them default to\
+        the equally spaced history """
+    if uniform(steps, h):
+        return ADAMS_BASHFORTH_WEIGHTS[order]
+    return adams_weights(history_nodes(steps, order), h)
+
+
+def adams_moulton_weights(order, h, steps=None):
+    """ Weights of the last `order - 1` derivatives and the derivative at the next point """
+    if uniform(steps, h):
+        return ADAMS_MOULTON_WEIGHTS[order]
+    return adams_weights(numpy.append(history_nodes(steps, order - 1), h), h)
+
+
+class MultistepHistory(object):
+
+    """
+    Ring buffer of the derivatives for the multistep methods.
+
+    Derivatives (scalars or arrays of the same shape) are kept as rows of a preallocated array,\
+    the oldest one is overwritten when the buffer is full. Each derivative is stored with the size\
+    of the step that separates it from the previous one, so that the history does not have to be\
+    resampled when the step size changes. Linear combinations of the history are computed as a\
+    single matrix product over the buffer.
+
+    :param length: Maximal number of the stored derivatives
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.values = None
+        self.steps = numpy.zeros(length)
+        self.size = 0
+        # Row of the next derivative
+        self.head = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.values[self.rows(self.size)] if self.size else [])
+
+    def rows(self, count):
+        """ Rows of the last `count` derivatives, the most recent last """
+        return (self.head - count + numpy.arange(count)) % self.length
+
+    def append(self, value, step):
+        """ Add the derivative `value` at the distance `step` from the previous one """
+        value = numpy.asarray(value, dtype=numpy.float_)
+        if self.values is None or self.values.shape[1:] != value.shape:
+            self.values = numpy.zeros((self.length,) + value.shape)
+            self.clear()
+
+        self.values[self.head] = value
+        self.steps[self.head] = step
+        self.head = (self.head + 1) % self.length
+        self.size = min(self.size + 1, self.length)
+
+    def clear(self):
+        self.size = 0
+        self.head = 0
+
+    def intervals(self, count):
+        """ Step sizes between the last `count` derivatives """
+        return self.steps[self.rows(count)[1:]]
+
+    def combination(self, weights, index=None):
+        """ Sum of the last `len(weights)` derivatives with the `weights`, restricted to the\
+            elements `index` of the derivatives if given """
+        coefficients = numpy.zeros(self.length)
+        coefficients[self.rows(len(weights))] = weights
+        values = self.values if index is None else self.values[:, index]
+        return numpy.tensordot(coefficients, values, axes=1)
+
+
+def multistep_sum(weights, fs, index=None):
+    """ Sum of the last `len(weights)` derivatives of the history `fs` with the `weights` """
+    if not len(weights):
+        return 0.
+    if isinstance(fs, MultistepHistory):
+        return fs.combination(weights, index)
+    values = numpy.asarray(fs[len(fs) - len(weights):], dtype=numpy.float_)
+    if index is not None:
+        values = values[:, index]
+    return numpy.tensordot(weights, values, axes=1)
+
+
+def adams_bashforth_correction(fs, h, order=None, steps=None, index=None):
+    """
+    Explicit Adams-Bashforth step of the order `order` from the history of derivatives `fs`\
+    (a sequence with the most recent value last or `MultistepHistory`). The step sizes between\
+    the derivatives are taken from `MultistepHistory` or `steps`, equal to `h` by default.\
+    Only the elements `index` of the derivatives are used if given.
+    """
+    if order is None:
+        order = min(len(ADAMS_BASHFORTH_COEFFICIENTS), len(fs))
+    if steps is None and isinstance(fs, MultistepHistory):
+        steps = fs.intervals(order)
+
+    weights = adams_bashforth_weights(order, h, steps)
+
+    return h * multistep_sum(weights, fs, index)
+
+
+def adams_moulton_solver(y, fs, A, B, h, order=None, steps=None, index=None):
+    """
+    Implicit Adams-Moulton step of the order `order` for the ODE with a linear function
+
+    \begin{equation}
+        \frac{d y(t)}{dt} = A(t) + B(t) y(t)
+    \end{equation}
+
+    from the history of derivatives `fs` as in `adams_bashforth_correction`.
+    """
+    if order is None:
+        order = min(len(ADAMS_MOULTON_COEFFICIENTS), len(fs))
+    if steps is None and isinstance(fs, MultistepHistory):
+        steps = fs.intervals(order - 1)
+
+    weights = adams_moulton_weights(order, h, steps)
+
+    return (y + h * (multistep_sum(weights[:-1], fs, index) + weights[-1] * A)) /\
+        (1 - h * B * weights[-1])
+
+
+def linearly_implicit_adams_moulton_solver(y, fs, f, J, h, order=None, steps=None):
+    """
+    Adams-Moulton step of the order `order` for the system of ODE
+
+    \begin{equation}
+        \frac{d y(t)}{dt} = f(y(t))
+    \end{equation}
+
+    with the derivative at the next point linearized with the Jacobian $J = \partial f / \partial y$
+
+    \begin{equation}
+        f(y_{n+1}) \approx f(y_n) + J (y_{n+1} - y_n)
+    \end{equation}
+
+    The step is then a solution of the linear system
 
-def adams_moulton_solver(y, fs, A, B, h, order=None):
+    \begin{equation}
+        (1 - h w J) (y_{n+1} - y_n) = h \left( \sum_j w_j f_j + w f(y_n) \right)
+    \end{equation}
+
+    where $w$ is the weight of the next point. For the diagonal $J = B$ and $f = A + B y$ this is\
+    `adams_moulton_solver`. The history of derivatives `fs` is as in `adams_bashforth_correction`.
+    """
     if order is None:
         order = min(len(ADAMS_MOULTON_COEFFICIENTS), len(fs))
+    if steps is None and isinstance(fs, MultistepHistory):
+        steps = fs.intervals(order - 1)
+
+    weights = adams_moulton_weights(order, h, steps)
+
+    rhs = h * (multistep_sum(weights[:-1], fs) + weights[-1] * f)
+    matrix = numpy.eye(len(y)) - h * weights[-1] * J
+
+    return y + numpy.linalg.solve(matrix, rhs)
+
+
+def resample_history(fs, h_old, h_new):
+    """
+    Multistep methods require the history of derivatives on the points equally spaced with the\
+    current step size. When the step size changes from `h_old` to `h_new`, the history `fs`\
+    (the most recent value last) is re-evaluated by the Lagrange polynomial through the old\
+    points
+
+    \begin{equation}
+        t_j = t - j h_{old} \to t - j h_{new}, \quad j = 1 \dots k
+    \end{equation}
+
+    where $t$ is the point of the next step. Values can be either scalars or arrays.
+    """
+    k = len(fs)
+    if k < 2 or h_old == h_new:
+        return list(fs)
+
+    old = -h_old * numpy.arange(k, 0, -1)
+    new = -h_new * numpy.arange(k, 0, -1)
+
+    lagrange = numpy.ones((k, k))
+    for j in range(k):
+        for m in range(k):
+            if m != j:
+                lagrange[:, j] *= (new - old[m]) / (old[j] - old[m])
+
+    return list(numpy.tensordot(lagrange, numpy.array(fs), axes=1))
+
+
+class StepController(object):
+
+    """
+    ## Adaptive step size control
+
+    Step size is updated after each step from the relative local error estimate of the step.\
+    The estimate is obtained as a difference of the predictor and corrector (or two predictors\
+    of the successive orders) of the multistep method of order $k$, and scales as $h^k$:
+
+    \begin{equation}
+        h_{new} = h \cdot s \left( \frac{\epsilon}{err} \right)^{1/k}
+    \end{equation}
+
+    The change factor is limited by `max_shrink` and `max_growth`. The step grows only if the\
+    factor exceeds `hysteresis` to avoid resampling the history every step. Steps are not\
+    rejected: the error estimate of the last step controls the size of the next one.
+    """
+
+    def __init__(self, tolerance=1e-4, min_step=1e-3, max_step=0.1,
+                 safety=0.9, max_shrink=0.5, max_growth=2., hysteresis=1.25):
+        self.tolerance = tolerance
+        self.min_step = min_step
+        self.max_step = max_step
+        self.safety = safety
+        self.max_shrink = max_shrink
+        self.max_growth = max_growth
+        self.hysteresis = hysteresis
+
+    def propose(self, h, error, order):
+        """ Step size to use after the step of size `h` with the relative error `error` """
+        if error == 0:
+            factor = self.max_growth
+        else:
+            factor = self.safety * (self.tolerance / error) ** (1. / order)
+
+        factor = min(max(factor, self.max_shrink), self.max_growth)
+        if error <= self.tolerance and factor < self.hysteresis:
+            return h
+
+        return min(max(h * factor, self.min_step), self.max_step)
 
-    bs, divider = ADAMS_MOULTON_COEFFICIENTS[order]
 
-    return (y + h * sum(b * f for b, f in zip(bs, fs[-order+1:] + [A])) / divider) /\
-        (1 - h * B * bs[-1] / divider)
+def integrate_1D(integrand, bounds, tolerance=None, points=()):
+    """ Integral of the `integrand` over the `bounds` and its error estimate.
 
+        The fixed Gauss-Legendre rule of `GAUSS_LEGENDRE_ORDER` is used by default and the error\
+        is not estimated. If the relative `tolerance` (or `QUADRATURE_TOLERANCE` by default) is\
+        set, the integral is computed by the adaptive Gauss-Kronrod rule instead.
+
+        :param points: Known discontinuities of the integrand, e.g. kinematic boundaries, to\
+                       subdivide the integration region at
+    """
+    tolerance = QUADRATURE_TOLERANCE if tolerance is None else tolerance
+    if tolerance:
+        return gauss_kronrod(integrand, bounds[0], bounds[1], tolerance, points=points)
 
-def integrate_1D(integrand, bounds):
     integral = gaussian(
         integrand,
         bounds[0], bounds[1]
@@ -112,7 +372,15 @@ def integrate_1D(integrand, bounds):
     return integral, error
 
 
-def integrate_2D(integrand, bounds):
+def integrate_2D(integrand, bounds, tolerance=None, points=()):
+    """ Integral of the `integrand(x, y)` over the region `bounds = ((a, b), (g, h))`, where the\
+        bounds of `y` are functions of `x`. See `integrate_1D`. `points` are the known\
+        discontinuities along `x`. """
+    tolerance = QUADRATURE_TOLERANCE if tolerance is None else tolerance
+    if tolerance:
+        return double_gauss_kronrod(integrand, bounds[0][0], bounds[0][1],
+                                    bounds[1][0], bounds[1][1], tolerance, points=points)
+
     integral = double_gaussian(
         integrand,
         bounds[0][0], bounds[0][1],
@@ -127,43 +395,244 @@ GAUSS_LEGENDRE_ORDER = 30
 points, weights = numpy.polynomial.legendre.leggauss(GAUSS_LEGENDRE_ORDER)
 # alpha, beta = orthopoly.rec_jacobi(GAUSS_LEGENDRE_ORDER, 0, 0)
 # points, weights = orthopoly.lobatto(alpha, beta, -1, 1)
-grid = numpy.meshgrid(points, points)
 
 
-def gaussian(f, a, b):
+class Quadrature(object):
 
-    sub = (b - a) / 2.
-    add = (b + a) / 2.
+    """ ## Gauss-Legendre quadrature over fixed bounds
 
-    if sub == 0:
-        return 0.
+        Nodes and weights are rescaled to the `bounds` once, so that the integral of the values\
+        sampled at the `nodes` is a single dot product
+
+        \begin{equation}
+            \int_a^b f(x) dx \approx \sum_i w_i f(x_i)
+        \end{equation}
+
+        Functions known at the points of a momentum grid are integrated with the weights\
+        `grid_weights` that include their linear interpolation to the nodes.
+    """
+
+    def __init__(self, bounds):
+        a, b = bounds
+        self.bounds = bounds
+
+        sub = (b - a) / 2.
+        self.nodes = sub * points + (b + a) / 2.
+        self.weights = sub * weights
+
+        self.interpolations = {}
+
+    def __call__(self, f):
+        return self.integrate(f(self.nodes))
+
+    def integrate(self, values):
+        """ Integral of the `values` sampled at the nodes along the last axis """
+        return numpy.dot(values, self.weights)
+
+    def interpolation(self, grid):
+        """ Matrix of the linear interpolation from the points of the `grid` to the nodes.\
+            Values outside of the `grid` are taken from its boundaries as in `numpy.interp`. """
+        key = grid.tostring()
+        if key not in self.interpolations:
+            index = numpy.clip(numpy.searchsorted(grid, self.nodes, side='right') - 1,
+                               0, len(grid) - 2)
+            t = numpy.clip((self.nodes - grid[index]) / (grid[index + 1] - grid[index]), 0, 1)
+
+            matrix = numpy.zeros((len(self.nodes), len(grid)))
+            matrix[numpy.arange(len(self.nodes)), index] = 1 - t
+            matrix[numpy.arange(len(self.nodes)), index + 1] += t
+            self.interpolations[key] = matrix
+
+        return self.interpolations[key]
 
-    return sub * numpy.dot(f(sub * points + add), weights)
+    def grid_weights(self, grid, factor=None):
+        """ Weights of the values at the points of the `grid` multiplied by the `factor` known\
+            at the nodes """
+        weights = self.weights if factor is None else self.weights * factor
+        return numpy.dot(weights, self.interpolation(grid))
 
+    def transform(self, g, h):
+        """ Nodes and weights of the double integral over the region
+            $x \in$ `bounds`, $y \in [g(x), h(x)]$. Bounds `g` and `h` take arrays of `x`.
 
-def remap_interval(f, x, y, bounds):
-    a, b, g, h = bounds
+            :returns: broadcastable arrays `x`, `y` and `weights` of the nodes with `x` along\
+                      the second to last axis and `y` along the last one
+        """
+        x = self.nodes[:, numpy.newaxis]
+        g_x = numpy.asarray(g(x))
+        h_x = numpy.asarray(h(x))
+        sub_y = (h_x - g_x) / 2.
 
-    sub_x = (b - a) / 2.
-    add_x = (b + a) / 2.
-    norm_x = sub_x * x + add_x
+        return (
+            x,
+            sub_y * points + (h_x + g_x) / 2.,
+            self.weights[:, numpy.newaxis] * sub_y * weights
+        )
 
-    h_x = numpy.vectorize(h)(norm_x)
-    g_x = numpy.vectorize(g)(norm_x)
-    sub_y = (h_x - g_x) / 2.
-    add_y = (h_x + g_x) / 2.
-    norm_y = sub_y * y + add_y
 
-    return sub_x * sub_y * f(norm_x, norm_y)
+quadratures = utils.LRUCache(budget=256, sizeof=lambda item: 1)
+
+
+def quadrature(bounds):
+    """ `Quadrature` over the `bounds`, built once for every distinct bounds """
+    bounds = tuple(bounds)
+    result = quadratures.get(bounds)
+    if result is None:
+        result = Quadrature(bounds)
+        quadratures[bounds] = result
+    return result
+
+
+def gaussian(f, a, b):
+
+    if a == b:
+        return 0.
+
+    return quadrature((a, b))(f)
 
 
 def double_gaussian(f, a, b, g, h):
 
-    x, y = grid
-    mesh = remap_interval(f, x, y, bounds=(a, b, g, h))
-    integral = numpy.dot(numpy.transpose(weights), numpy.dot(mesh, weights))
+    x, y, w = quadrature((a, b)).transform(g, h)
+
+    return numpy.sum(w * f(x, y))
+
+
+""" ### Adaptive quadrature
+
+    The 15-point Gauss-Kronrod rule reuses the nodes of the 7-point Gauss-Legendre rule, the\
+    difference of the two estimates the error of the integral over the interval. Intervals with\
+    the largest errors are bisected until the total error drops below the relative `tolerance`.
+"""
+
+# Relative tolerance of the adaptive quadrature used by `integrate_1D` and `integrate_2D`, the\
+# fixed Gauss-Legendre rule is used if `0`
+QUADRATURE_TOLERANCE = float(utils.getenv('QUADRATURE_TOLERANCE', 0))
+# Maximal number of the intervals of the adaptive quadrature
+QUADRATURE_LIMIT = 200
+
+kronrod_points = numpy.array([
+    -0.991455371120812639206854697526329, -0.949107912342758524526189684047851,
+    -0.864864423359769072789712788640926, -0.741531185599394439863864773280788,
+    -0.586087235467691130294144845693013, -0.405845151377397166906606412076961,
+    -0.207784955007898467600689403773245, 0.,
+    0.207784955007898467600689403773245, 0.405845151377397166906606412076961,
+    0.586087235467691130294144845693013, 0.741531185599394439863864773280788,
+    0.864864423359769072789712788640926, 0.949107912342758524526189684047851,
+    0.991455371120812639206854697526329
+])
+kronrod_weights = numpy.array([
+    0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+    0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+    0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+    0.204432940075298892414161999234649, 0.209482141084727828012999174891714,
+    0.204432940075298892414161999234649, 0.190350578064785409913256402421014,
+    0.169004726639267902826583426598550, 0.140653259715525918745189590510238,
+    0.104790010322250183839876322541518, 0.063092092629978553290700663189204,
+    0.022935322010529224963732008058970
+])
+# Weights of the embedded Gauss rule at the odd Kronrod nodes
+embedded_weights = numpy.zeros(15)
+embedded_weights[1::2] = [
+    0.129484966168869693270611432679082, 0.279705391489276667901467771423780,
+    0.381830050505118944950369775488975, 0.417959183673469387755102040816327,
+    0.381830050505118944950369775488975, 0.279705391489276667901467771423780,
+    0.129484966168869693270611432679082
+]
+
+
+def kronrod(f, lower, upper):
+    """ Integrals, error estimates and integrals of the absolute value of the integrand over all\
+        intervals `[lower, upper]` at once. The function `f` may return a pair of its values and\
+        magnitudes if the latter differ from the absolute values. """
+    sub = (upper - lower)[:, numpy.newaxis] / 2.
+    x = sub * kronrod_points + (upper + lower)[:, numpy.newaxis] / 2.
+
+    values = f(x.ravel())
+    if isinstance(values, tuple):
+        values, magnitudes = values
+    else:
+        magnitudes = numpy.abs(values)
+    values = numpy.reshape(values, x.shape)
+    magnitudes = numpy.reshape(magnitudes, x.shape)
+
+    integrals = sub[:, 0] * numpy.dot(values, kronrod_weights)
+    errors = numpy.abs(integrals - sub[:, 0] * numpy.dot(values, embedded_weights))
+    return integrals, errors, sub[:, 0] * numpy.dot(magnitudes, kronrod_weights)
+
+
+def adaptive_kronrod(f, a, b, tolerance, points=(), limit=None):
+    """ Adaptive Gauss-Kronrod integral of `f` over $[a, b]$, see `gauss_kronrod`.
+
+        The error is controlled relative to the integral of the absolute value of the integrand,\
+        so that the integrals with cancellations, like the collision integrals close to the\
+        equilibrium, do not require the precision beyond the rounding errors.
+
+        :returns: the integral, its absolute error estimate and the integral of the magnitude
+    """
+    if a == b:
+        return 0., 0., 0.
+
+    limit = limit or QUADRATURE_LIMIT
+    edges = numpy.unique(numpy.concatenate([[a, b], [x for x in points if a < x < b]]))
+    lower, upper = edges[:-1], edges[1:]
+    integrals, errors, magnitudes = kronrod(f, lower, upper)
+
+    while len(lower) < limit:
+        allowed = tolerance * magnitudes.sum()
+        if errors.sum() <= allowed:
+            break
+
+        # Bisect the intervals that exceed their share of the allowed error
+        refine = errors > allowed / len(lower)
+        refine &= errors >= numpy.sort(errors)[-min(limit - len(lower), len(lower))]
+        middle = (lower[refine] + upper[refine]) / 2.
+        new_lower = numpy.concatenate([lower[refine], middle])
+        new_upper = numpy.concatenate([middle, upper[refine]])
+        new_integrals, new_errors, new_magnitudes = kronrod(f, new_lower, new_upper)
+
+        lower = numpy.concatenate([lower[~refine], new_lower])
+        upper = numpy.concatenate([upper[~refine], new_upper])
+        integrals = numpy.concatenate([integrals[~refine], new_integrals])
+        errors = numpy.concatenate([errors[~refine], new_errors])
+        magnitudes = numpy.concatenate([magnitudes[~refine], new_magnitudes])
+
+    return integrals.sum(), errors.sum(), magnitudes.sum()
+
+
+def gauss_kronrod(f, a, b, tolerance, points=(), limit=None):
+    """ Adaptive Gauss-Kronrod integral of the vectorized function `f` over $[a, b]$
+
+        :param tolerance: Relative tolerance of the integral of $|f|$
+        :param points: Points inside of $[a, b]$ where the region is subdivided from the start
+        :param limit: Maximal number of the intervals, `QUADRATURE_LIMIT` by default
+        :returns: the integral and its absolute error estimate
+    """
+    integral, error, _ = adaptive_kronrod(f, a, b, tolerance, points=points, limit=limit)
+    return integral, error
+
+
+def double_gauss_kronrod(f, a, b, g, h, tolerance, points=()):
+    """ Adaptive integral of `f(x, y)` over $x \in [a, b]$, $y \in [g(x), h(x)]$ as the outer\
+        adaptive integral of the inner ones. Inner integrals are computed with a tenth of the\
+        `tolerance`, their errors are added to the outer one. """
+    if a == b:
+        return 0., 0.
+
+    inner_errors = []
+
+    def outer(x):
+        results = numpy.array([
+            adaptive_kronrod(lambda y: f(x_i, y), float(g(x_i)), float(h(x_i)), tolerance / 10.)
+            for x_i in x
+        ])
+        inner_errors.append(results[:, 1].max())
+        return results[:, 0], results[:, 2]
+
+    integral, error = gauss_kronrod(outer, a, b, tolerance, points=points)
 
-    return integral
+    # Upper bound of the inner errors contribution: the largest one over the region length
+    return integral, error + max(inner_errors) * abs(b - a)
 
 
 def lambda_integrate(bounds=(GRID.MIN_MOMENTUM, GRID.MAX_MOMENTUM)):
@@ -1,5 +1,8 @@
+import time
+import numpy
 from itertools import izip
 from multiprocessing import Pool, Pipe, Process, cpu_count
+from multiprocessing.sharedctypes import RawArray
 
 
 worker_count = cpu_count()
@@ -12,15 +15,17 @@ orders = []
 pool = None
 
 
-def init_pool():
+def init_pool(initializer=None, initargs=()):
     global pool
-    pool = Pool(processes=worker_count)
+    pool = Pool(processes=worker_count, initializer=initializer, initargs=initargs)
 
 
 def close_pool():
+    global pool
     pool.close()
     pool.terminate()
     pool.join()
+    pool = None
 
 
 def target(args, **kw):
@@ -38,6 +43,223 @@ def poolmap(cls, func_name, arguments):
     return result
 
 
+# ## Shared-memory state
+
+class SharedState(object):
+
+    """ Particles state and cosmological parameters kept in the shared-memory buffers.
+
+        Persistent pool workers receive the particles and interactions once, when the pool is\
+        started, and keep them resident attached to the buffers. The parent process publishes\
+        the state before submitting the tasks and increments the state version. Workers reload\
+        the state only when the version changes, so the tasks only carry the integral index and\
+        the momenta and their overhead does not depend on the size of the model.
+
+        Workers compute the collision integrals terms only, the parent process sums them up and\
+        updates the distribution functions. """
+
+    def __init__(self, params, particles, interactions):
+        self.params = params
+        self.particles = [particle for particle in particles if hasattr(particle, '_distribution')]
+        # Particles described by their density only, e.g. `particles.DensityParticle`
+        self.density_particles = [particle for particle in particles
+                                  if hasattr(particle, '_density')]
+        self.integrals = [integral for interaction in interactions
+                          for integral in interaction.integrals]
+
+        self.topology = (list(particles), list(interactions))
+
+        self.version_buffer = RawArray('l', 1)
+        self.params_buffer = RawArray('d', len(type(params).__slots__))
+        self.buffers = []
+        for particle in self.particles:
+            self.buffers.append({
+                # `T` and `aT` of the particle
+                'scalars': RawArray('d', 2),
+                'distribution': RawArray('d', particle.grid.MOMENTUM_SAMPLES),
+            })
+        # `T`, `aT`, density and chemical potential of the density particles
+        self.density_buffers = [RawArray('d', 4) for particle in self.density_particles]
+
+        self.views = None
+        self.version = None
+        # Measured time of the integrals computation per momentum point by integral index
+        self.costs = {}
+
+    def describes(self, particles, interactions):
+        """ Check if the state was created for the same set of particles and interactions """
+        old_particles, old_interactions = self.topology
+        return (
+            len(old_particles) == len(particles)
+            and all(old is new for old, new in izip(old_particles, particles))
+            and len(old_interactions) == len(interactions)
+            and all(old is new for old, new in izip(old_interactions, interactions))
+            and all(old is new for old, new in izip(
+                self.integrals,
+                [integral for interaction in interactions for integral in interaction.integrals]
+            ))
+        )
+
+    def attach(self):
+        """ Create NumPy views of the shared buffers in the current process """
+        self.views = [
+            {
+                'scalars': numpy.ctypeslib.as_array(buffers['scalars']),
+                'distribution': numpy.ctypeslib.as_array(buffers['distribution']),
+            }
+            for buffers in self.buffers
+        ]
+        self.density_views = [numpy.ctypeslib.as_array(buffer) for buffer in self.density_buffers]
+        self.version_view = numpy.ctypeslib.as_array(self.version_buffer)
+        self.params_view = numpy.ctypeslib.as_array(self.params_buffer)
+
+    def bind(self):
+        """ Make the worker process particles use the shared distribution functions directly """
+        self.attach()
+        for particle, views in izip(self.particles, self.views):
+            particle._distribution = views['distribution']
+
+    def publish(self):
+        """ Copy the current state of the parent process objects to the shared buffers """
+        if self.views is None:
+            self.attach()
+
+        for i, key in enumerate(type(self.params).__slots__):
+            value = getattr(self.params, key)
+            self.params_view[i] = numpy.nan if value is None else value
+
+        for particle, views in izip(self.particles, self.views):
+            views['scalars'][:] = (particle.T, particle.aT)
+            views['distribution'][:] = particle._distribution
+
+        for particle, view in izip(self.density_particles, self.density_views):
+            view[:] = (particle.T, particle.aT, particle._density, particle.mu)
+
+        self.version_view[0] += 1
+
+    def load(self):
+        """ Update the worker process objects to the last state published by the parent """
+        if self.version == self.version_view[0]:
+            return
+
+        for i, key in enumerate(type(self.params).__slots__):
+            setattr(self.params, key, self.params_view[i])
+
+        for particle, views in izip(self.particles, self.views):
+            particle.T, particle.aT = views['scalars']
+
+        for particle, view in izip(self.density_particles, self.density_views):
+            particle.T, particle.aT, particle._density, particle.mu = view
+
+        self.version = self.version_view[0]
+
+    """ ### Scheduling
+
+        All collision integrals of a step are split into work items `(particle, integral, p0)`\
+        with the momenta `p0` chunked so that each item takes a similar estimated time. The items\
+        are submitted together, the most expensive first, so that the workers stay busy for the\
+        whole collision stage. The cost of each integral per momentum point is measured by the\
+        workers and refined every step. """
+
+    # Number of work items per worker to even out the estimation errors
+    ITEMS_PER_WORKER = 4
+
+    def cost(self, integral):
+        """ Estimated time of the `integral` computation per momentum point """
+        if not self.costs:
+            return 1.
+        return self.costs.get(integral, sum(self.costs.values()) / len(self.costs))
+
+    def schedule(self, particles):
+        """ Work items of the collision integrals of the `particles`:\
+            `(particle index, integral index, first momentum index, momenta)` """
+        integral_indices = {id(integral): i for i, integral in enumerate(self.integrals)}
+
+        items = []
+        for particle in particles:
+            index = self.particles.index(particle)
+            for integral in particle.collision_integrals:
+                items.append((index, integral_indices[id(integral)], particle.grid.TEMPLATE))
+
+        total = sum(self.cost(integral) * len(momenta) for _, integral, momenta in items)
+        target = total / (worker_count * self.ITEMS_PER_WORKER)
+
+        tasks = []
+        for index, integral, momenta in items:
+            size = max(1, int(target / self.cost(integral)))
+            for start in range(0, len(momenta), size):
+                tasks.append((index, integral, start, momenta[start:start + size]))
+
+        tasks.sort(key=lambda task: -self.cost(task[1]) * len(task[3]))
+        return tasks
+
+    def gather(self, tasks, results):
+        """ Assemble the results of the work items into the sums of the linearized collision\
+            integrals `(A, B)` of each particle and update the cost estimations.
+
+            :returns: dictionary `{particle index: (A, B)}`
+        """
+        terms = {}
+        times = {}
+        for (index, integral, start, momenta), (A, B, elapsed) in izip(tasks, results):
+            particle = self.particles[index]
+            integrals = terms.setdefault(index, {})
+            if integral not in integrals:
+                integrals[integral] = (numpy.zeros(particle.grid.MOMENTUM_SAMPLES),
+                                       numpy.zeros(particle.grid.MOMENTUM_SAMPLES))
+            integrals[integral][0][start:start + len(momenta)] = A
+            integrals[integral][1][start:start + len(momenta)] = B
+
+            total, points = times.get(integral, (0., 0))
+            times[integral] = (total + elapsed, points + len(momenta))
+
+        self.costs.update({integral: total / points for integral, (total, points) in times.items()})
+
+        return {
+            index: (sum(integrals[i][0] for i in sorted(integrals)),
+                    sum(integrals[i][1] for i in sorted(integrals)))
+            for index, integrals in terms.items()
+        }
+
+    def integrate(self, task):
+        """ Worker side of the work item: linearized collision integral terms for the momenta """
+        _, integral, _, p0 = task
+        self.load()
+
+        start = time.time()
+        integral = self.integrals[integral]
+        A, B = integral.linearized(p0)
+        return A, B, time.time() - start
+
+
+# State the pool workers are attached to
+state = None
+
+
+def attach_state(shared_state):
+    """ Pool initializer that makes the shared state resident in the worker """
+    global state
+    state = shared_state
+    state.bind()
+
+
+def shared_target(task):
+    return state.integrate(task)
+
+
+def init_shared_pool(shared_state):
+    """ Start persistent workers attached to the `shared_state`, replacing the running ones """
+    global state
+    if pool is not None:
+        close_pool()
+    state = shared_state
+    init_pool(initializer=attach_state, initargs=(shared_state,))
+
+
+def shared_poolmap(tasks):
+    return pool.map_async(shared_target, tasks, chunksize=1)
+
+
 # ## Worker-oriented parallelization
 
 def map_order(i):
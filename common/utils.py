@@ -6,7 +6,7 @@ import contextlib
 import numpy
 import traceback
 import functools
-from collections import deque
+from collections import deque, OrderedDict
 
 
 class PicklableObject(object):
@@ -79,6 +79,204 @@ class ring_deque(deque):
         super(ring_deque, self).append(data)
 
 
+class LRUCache(object):
+    """ Least recently used cache with a limit on the total size of the stored values.
+
+        :param budget: Maximal total size of the values in bytes
+        :param sizeof: Function that returns the size of a value in bytes
+    """
+
+    def __init__(self, budget, sizeof=sys.getsizeof):
+        self.budget = budget
+        self.sizeof = sizeof
+        self.size = 0
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+
+        # Mark the item as the most recently used one
+        value, size = self.items.pop(key)
+        self.items[key] = (value, size)
+        return value
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+
+        size = self.sizeof(value)
+        if size > self.budget:
+            return
+
+        self.items[key] = (value, size)
+        self.size += size
+
+        while self.size > self.budget:
+            _, (_, evicted) = self.items.popitem(last=False)
+            self.size -= evicted
+
+    def pop(self, key):
+        if key in self.items:
+            value, size = self.items.pop(key)
+            self.size -= size
+            return value
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+
+class History(object):
+    """ Growable table of floating point records with a fixed set of columns.
+
+        Records are stored in a preallocated array that doubles its capacity when full, so that\
+        appending a record takes amortized constant time. The table is converted into\
+        `pandas.DataFrame` only on demand.
+
+        :param columns: Names of the columns
+        :param capacity: Initial number of records to allocate
+    """
+
+    def __init__(self, columns, capacity=256):
+        self.columns = list(columns)
+        self.index = {column: i for i, column in enumerate(self.columns)}
+        self.values = numpy.empty((capacity, len(self.columns)))
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, column):
+        """ View of the stored values of the column """
+        return self.values[:self.size, self.index[column]]
+
+    def append(self, record):
+        """ Append a record given as a dictionary. Missing columns are filled with `nan`. """
+        if self.size == len(self.values):
+            values = numpy.empty((max(2 * len(self.values), 1), len(self.columns)))
+            values[:self.size] = self.values[:self.size]
+            self.values = values
+
+        row = self.values[self.size]
+        row.fill(numpy.nan)
+        for column, value in record.items():
+            row[self.index[column]] = value
+        self.size += 1
+
+    def last(self):
+        """ The last record as an array of values ordered as `columns` """
+        return self.values[self.size - 1]
+
+    def frame(self):
+        import pandas
+        return pandas.DataFrame(self.values[:self.size].copy(), columns=self.columns)
+
+
+class HistoryFile(object):
+    """ Append-only file with the records of `History`.
+
+        The file starts with a line of tab-separated column names followed by the records as raw\
+        native floating point numbers. Only the records added since the last write are appended,\
+        and the file is flushed every `flush_freq` writes, so that it can be read with\
+        `read_history` while the calculation is running. A closed file is reopened to append the\
+        records written after `close`.
+
+        :param path: Path of the file
+        :param columns: Names of the columns
+        :param flush_freq: Number of writes between flushes of the file
+        :param written: Number of the first records of the existing file to keep and append to,\
+                        e.g. the ones written before the checkpoint of a resumed calculation.\
+                        A new file is written if `None`
+    """
+
+    def __init__(self, path, columns, flush_freq=1, written=None):
+        self.path = path
+        self.columns = list(columns)
+        self.flush_freq = max(int(flush_freq), 1)
+        self.written = 0
+        self.pending = 0
+
+        header = "\t".join(self.columns) + "\n"
+
+        if written is None:
+            self.file = open(path, 'wb')
+            self.file.write(header)
+            self.file.flush()
+            return
+
+        self.file = open(path, 'r+b')
+        if self.file.readline() != header:
+            self.file.close()
+            raise ValueError("File {} does not have the columns {}".format(path, self.columns))
+
+        record = len(self.columns) * numpy.dtype(float).itemsize
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() < len(header) + written * record:
+            self.file.close()
+            raise ValueError("File {} has less than {} records".format(path, written))
+
+        # Records written after the checkpoint are superseded by the resumed calculation
+        self.file.seek(len(header) + written * record)
+        self.file.truncate()
+        self.written = written
+
+    def write(self, history):
+        """ Append the records of `history` added since the last write """
+        self.reopen()
+        if len(history) > self.written:
+            history.values[self.written:len(history)].tofile(self.file)
+            self.written = len(history)
+
+        self.tick()
+
+    def append(self, record):
+        """ Append a single record given as an array of values ordered as `columns` """
+        self.reopen()
+        numpy.asarray(record, dtype=float).tofile(self.file)
+        self.written += 1
+
+        self.tick()
+
+    def tick(self):
+        self.pending += 1
+        if self.pending >= self.flush_freq:
+            self.flush()
+
+    def flush(self):
+        if not self.file.closed:
+            self.file.flush()
+        self.pending = 0
+
+    def reopen(self):
+        if self.file.closed:
+            self.file = open(self.path, 'ab')
+            self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_history(path):
+    """ Read the file written by `HistoryFile` into `pandas.DataFrame`.\
+        An incomplete last record of a file being written is ignored. """
+    import pandas
+
+    with open(path, 'rb') as f:
+        columns = f.readline().rstrip("\n").split("\t")
+        values = numpy.fromfile(f)
+
+    rows = len(values) // len(columns)
+    return pandas.DataFrame(values[:rows * len(columns)].reshape(rows, len(columns)),
+                            columns=columns)
+
+
 class benchmark(object):
     """ Simple benchmarking context manager """
     def __init__(self, name):
@@ -3,13 +3,14 @@
 import os
 import sys
 import numpy
-import pandas
+import pickle
 import time
 from datetime import timedelta
 
 from common import UNITS, Params, integrators, parallelization, utils
 
 import kawano
+from particles import REGIMES, IntermediateParticle
 
 
 class Universe(object):
@@ -19,6 +20,12 @@ class Universe(object):
 
     # System state is rendered to the log file each `log_freq` steps
     log_freq = 1
+    # New records of the history are appended to `evolution.history` every step and the file\
+    # is flushed each `history_flush_freq` steps
+    history_flush_freq = 10
+    # Full state of the calculation is saved to `checkpoint.pickle` each `checkpoint_freq` steps\
+    # to be able to `resume` it later. Automatic checkpoints are disabled if `0`
+    checkpoint_freq = int(utils.getenv('CHECKPOINT_FREQ', 100))
     clock_start = None
 
     particles = None
@@ -31,7 +38,12 @@ class Universe(object):
 
     step_monitor = None
 
-    data = pandas.DataFrame(columns=('aT', 'T', 'a', 'x', 't', 'rho', 'fraction'))
+    # Adaptive step size controller `integrators.StepController`, fixed `params.dy` if `None`
+    step_controller = None
+
+    # Evolution of the Universe parameters, `utils.History` of records per step
+    history = None
+    kawano_history = None
 
     def __init__(self, folder='logs', plotting=True, params=None, grid=None):
         """
@@ -48,6 +60,8 @@ class Universe(object):
 
         self.params = Params() if not params else params
 
+        self.history = utils.History(('aT', 'T', 'a', 'x', 't', 'rho', 'N_eff', 'fraction'))
+
         # self.graphics = None
         # if utils.getboolenv("PLOT", plotting):
         #     from plotting import Plotting
@@ -57,10 +71,25 @@ class Universe(object):
 
         # Controls parallelization of the collision integrals calculations
         self.PARALLELIZE = utils.getboolenv("PARALLELIZE", True)
-        if self.PARALLELIZE:
+        # Pool workers attach to the particles state in the shared memory instead of receiving\
+        # pickled particles with every task. Such pool is started with the first collisions step
+        self.SHARED_STATE = utils.getboolenv("SHARED_STATE", True)
+        self.shared_state = None
+        if self.PARALLELIZE and not self.SHARED_STATE:
             parallelization.init_pool()
 
+        # Distribution function snapshots of the particles are written to the files\
+        # `distribution_<name>.history` instead of being kept in memory
+        self.STREAM_SNAPSHOTS = utils.getboolenv("STREAM_SNAPSHOTS", False)
+        # Number of the snapshots of the particles written before the resumed checkpoint
+        self.snapshots = {}
+
         self.fraction = 0
+        # Equally spaced history of the temperature equation derivative for the multistep method
+        self.fraction_history = []
+        # Relative local error estimates of the last step
+        self.step_error = 0.
+        self.distribution_error = 0.
 
         self.step = 1
 
@@ -69,7 +98,17 @@ class Universe(object):
         self.kawano_log = open(os.path.join(self.folder, datafile), 'w')
         self.kawano_log.write("\t".join(kawano.heading) + "\n")
         self.kawano = kawano
-        self.kawano_data = pandas.DataFrame(columns=self.kawano.heading)
+        self.kawano_history = utils.History(self.kawano.heading)
+
+    @property
+    def data(self):
+        """ Evolution of the Universe parameters as `pandas.DataFrame` """
+        return self.history.frame()
+
+    @property
+    def kawano_data(self):
+        """ Evolution of the KAWANO inputs as `pandas.DataFrame` """
+        return self.kawano_history.frame()
 
     def init_oscillations(self, pattern, particles):
         self.oscillations = (pattern, particles)
@@ -95,19 +134,36 @@ class Universe(object):
         if self.params.rho is None:
             self.update_particles()
             self.params.update(self.total_energy_density())
-        self.save_params()
+        if self.STREAM_SNAPSHOTS:
+            self.open_snapshot_files()
+        # Resumed or continued calculation already has the record of its current state
+        if not len(self.history):
+            self.save_params()
+
+        history_file = utils.HistoryFile(os.path.join(self.folder, "evolution.history"),
+                                         self.history.columns, self.history_flush_freq)
+        history_file.write(self.history)
 
         while self.params.T > T_final:
             try:
                 self.log()
                 self.make_step()
                 self.save()
+                self.adapt_step()
                 self.step += 1
-                self.data.to_pickle(os.path.join(self.folder, "evolution.pickle"))
+                history_file.write(self.history)
+                if self.checkpoint_freq and self.step % self.checkpoint_freq == 0:
+                    self.checkpoint()
             except KeyboardInterrupt:
                 print "Keyboard interrupt!"
                 break
 
+        history_file.close()
+        # Snapshots of a continued calculation are appended to the same files
+        for particle in self.particles:
+            if particle.snapshot_file:
+                particle.snapshot_file.close()
+
         self.log()
         if export:
             self.export()
@@ -134,31 +190,179 @@ class Universe(object):
 
         self.data.to_pickle(os.path.join(self.folder, "evolution.pickle"))
 
+    def checkpoint(self, path=None):
+        """ Save the state of the calculation that is needed to `resume` it: the cosmological\
+            parameters, the history of the Universe and KAWANO inputs, the multistep method\
+            history and the state of all particles (with the last distribution snapshot only).\
+            Snapshots streamed to the files are flushed and their number is saved, so that the\
+            resumed calculation appends to them.
+
+            Particles and interactions themselves are not saved - the calculation is resumed\
+            in the Universe set up by the same script. """
+        path = path or os.path.join(self.folder, "checkpoint.pickle")
+
+        snapshots = {}
+        for particle in self.particles:
+            if particle.snapshot_file:
+                particle.snapshot_file.flush()
+                snapshots[particle.name] = particle.snapshot_file.written
+
+        state = {
+            'params': {key: getattr(self.params, key) for key in self.params.__slots__},
+            'step': self.step,
+            'fraction': self.fraction,
+            'fraction_history': self.fraction_history,
+            'step_error': self.step_error,
+            'distribution_error': self.distribution_error,
+            'history': self.history,
+            'kawano_history': self.kawano_history,
+            'particles': [(particle.name, self.particle_state(particle))
+                          for particle in self.particles],
+            'snapshots': snapshots
+        }
+
+        # Replace the previous checkpoint only when the new one is complete
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(path + ".tmp", path)
+
+        return path
+
+    def resume(self, path=None):
+        """ Restore the state of the calculation saved with `checkpoint`. Particles have to be\
+            added and KAWANO initialized (if used) the same way as in the original calculation. """
+        path = path or os.path.join(self.folder, "checkpoint.pickle")
+
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+
+        for key, value in state['params'].items():
+            setattr(self.params, key, value)
+
+        self.step = state['step']
+        self.fraction = state['fraction']
+        self.fraction_history = state['fraction_history']
+        self.step_error = state['step_error']
+        self.distribution_error = state['distribution_error']
+        self.history = state['history']
+
+        particles = dict(state['particles'])
+        if len(particles) != len(self.particles) or \
+                any(particle.name not in particles for particle in self.particles):
+            raise ValueError("Checkpoint {} was saved for particles {}".format(
+                path, ", ".join(name for name, _ in state['particles'])))
+
+        for particle in self.particles:
+            particle.__setstate__(particles[particle.name])
+
+        # Snapshot files are reopened by `evolve` after the snapshots saved before the checkpoint
+        self.snapshots = state.get('snapshots', {})
+        for particle in self.particles:
+            if particle.snapshot_file:
+                particle.snapshot_file.close()
+                particle.snapshot_file = None
+
+        if self.kawano and state['kawano_history'] is not None:
+            # Rewrite the KAWANO log up to the checkpoint
+            self.kawano_history = state['kawano_history']
+            for i in range(len(self.kawano_history)):
+                self.kawano_log.write("\t".join("{:e}".format(item)
+                                                for item in self.kawano_history.values[i]) + "\n")
+
+        print "Resumed from {} at step #{}".format(path, self.step)
+
+    @staticmethod
+    def particle_state(particle):
+        """ Saveable fields of the particle except the references to the shared objects. Only\
+            the last of the distribution function snapshots is kept, so that the size of the\
+            checkpoint does not grow with the length of the calculation. """
+        state = {key: value for key, value in particle.__getstate__().items()
+                 if key not in ('params', 'grid', 'collision_integrals')}
+        if 'distribution' in state.get('data', {}):
+            state['data'] = dict(state['data'], distribution=state['data']['distribution'][-1:])
+        return state
+
     def make_step(self):
         self.integrand(self.params.x, self.params.aT)
 
         order = min(self.step + 1, 5)
-        fs = self.data['fraction'].tail(order-1).values.tolist()
+        fs = self.fraction_history[-(order-1):]
         fs.append(self.fraction)
 
-        self.params.aT +=\
-            integrators.adams_bashforth_correction(fs=fs, h=self.params.dy, order=order)
+        correction = integrators.adams_bashforth_correction(fs=fs, h=self.params.dy, order=order)
+
+        # Error estimate of the temperature: difference of the methods of successive orders
+        lower_correction = integrators.adams_bashforth_correction(fs=fs, h=self.params.dy,
+                                                                  order=order - 1)
+        self.step_error = max(abs(correction - lower_correction) / abs(self.params.aT),
+                              self.distribution_error)
+
+        self.params.aT += correction
         self.params.x += self.params.dx
 
         self.params.update(self.total_energy_density())
         if self.step_monitor:
             self.step_monitor(self)
 
+    def adapt_step(self):
+        """ ### Adaptive step size
+
+            If `step_controller` is set, the step size `params.dy` for the next step is chosen\
+            from the error estimate of the last step. The history of the temperature equation is\
+            then resampled to the points equally spaced with the new step size, while the\
+            collision integrals history keeps the step sizes and is used as is. """
+        if not self.step_controller:
+            return
+
+        order = min(self.step + 1, 5)
+        dy = self.step_controller.propose(self.params.dy, self.step_error, order)
+        if dy == self.params.dy:
+            return
+
+        self.fraction_history[-4:] = integrators.resample_history(self.fraction_history[-4:],
+                                                                  self.params.dy, dy)
+
+        print "Step size: {:.3e} -> {:.3e}".format(self.params.dy, dy)
+        self.params.dy = dy
+
     def add_particles(self, particles):
         for particle in particles:
             particle.set_params(self.params)
 
         self.particles += particles
 
+    def open_snapshot_files(self):
+        """ Attach the files `distribution_<name>.history` receiving the distribution function\
+            snapshots to the particles. New files start with the current distribution, the files\
+            of a resumed calculation keep the snapshots written before the checkpoint. """
+        for particle in self.particles:
+            if particle.snapshot_file or not hasattr(particle, 'save_snapshot'):
+                continue
+
+            written = self.snapshots.get(particle.name)
+            particle.snapshot_file = utils.HistoryFile(
+                os.path.join(self.folder,
+                             'distribution_{}.history'.format(particle.name.replace(' ', '_'))),
+                ["{:e}".format(y / UNITS.MeV) for y in particle.grid.TEMPLATE],
+                self.history_flush_freq,
+                written=written
+            )
+            if written is None:
+                particle.save_snapshot()
+
     def update_particles(self):
         """ ### 1. Update particles state
             Update particle species distribution functions, check for regime switching,\
             update precalculated variables like energy density and pressure. """
+
+        # Thermodynamics of the massive equilibrium particles are computed together. Dust regime\
+        # has analytic density, energy density and pressure and only needs $I(2)$ and $I(4)$
+        for regime, names in [(REGIMES.INTERMEDIATE, IntermediateParticle.MOMENTS),
+                              (REGIMES.DUST, ('I2', 'I4'))]:
+            IntermediateParticle.moments([particle for particle in self.particles
+                                          if particle.regime == regime],
+                                         aT=self.params.aT, names=names)
+
         for particle in self.particles:
             particle.update()
 
@@ -181,7 +385,9 @@ class Universe(object):
         particles = [particle for particle in self.particles if particle.collision_integrals]
 
         with utils.printoptions(precision=2):
-            if self.PARALLELIZE:
+            if self.PARALLELIZE and self.SHARED_STATE:
+                self.calculate_shared_collisions(particles)
+            elif self.PARALLELIZE:
                 for particle in particles:
                     parallelization.orders = [
                         (particle,
@@ -198,6 +404,43 @@ class Universe(object):
                                          + repr(particle.collision_integral)):
                         particle.collision_integral = particle.integrate_collisions()
 
+        self.distribution_error = max([getattr(particle, 'step_error', 0.)
+                                       for particle in particles] or [0.])
+
+    def calculate_shared_collisions(self, particles):
+        """ Collision integrals computed by the persistent pool workers attached to the shared\
+            state. Workers are restarted only if the set of particles or interactions changes. """
+        if (
+            self.shared_state is None
+            or parallelization.state is not self.shared_state
+            or not self.shared_state.describes(self.particles, self.interactions)
+        ):
+            self.shared_state = parallelization.SharedState(self.params, self.particles,
+                                                            self.interactions)
+            parallelization.init_shared_pool(self.shared_state)
+
+        self.shared_state.publish()
+
+        shared = [particle for particle in particles if particle in self.shared_state.particles]
+        tasks = self.shared_state.schedule(shared)
+        result = parallelization.shared_poolmap(tasks)
+
+        for particle in particles:
+            if particle not in shared:
+                with utils.benchmark(lambda: "I(" + particle.symbol + ") = "
+                                     + repr(particle.collision_integral)):
+                    particle.collision_integral = particle.integrate_collisions()
+
+        with utils.benchmark("Collision integrals ({} work items)".format(len(tasks))):
+            terms = self.shared_state.gather(tasks, result.get(1000))
+
+        for particle in shared:
+            A, B = terms[self.shared_state.particles.index(particle)]
+            particle.collision_integral = particle.solve_collision_integral(
+                particle.grid.TEMPLATE, A, B
+            )
+            print "I(" + particle.symbol + ") = " + repr(particle.collision_integral)
+
     def update_distributions(self):
         """ ### 4. Update particles distributions """
 
@@ -258,7 +501,10 @@ class Universe(object):
         return self.fraction
 
     def save_params(self):
-        self.data = self.data.append({
+        self.fraction_history.append(self.fraction)
+        del self.fraction_history[:-4]
+
+        self.history.append({
             'aT': self.params.aT,
             'T': self.params.T,
             'a': self.params.a,
@@ -267,7 +513,7 @@ class Universe(object):
             'N_eff': self.params.N_eff,
             't': self.params.t,
             'fraction': self.fraction
-        }, ignore_index=True)
+        })
 
     def save(self):
         """ Save current Universe parameters into the data arrays or output files """
@@ -284,8 +530,8 @@ class Universe(object):
                 self.kawano.heading[0]: self.params.t / UNITS.s,
                 self.kawano.heading[1]: self.params.x / UNITS.MeV,
                 self.kawano.heading[2]: self.params.T / UNITS.K9,
-                self.kawano.heading[3]: (self.params.T - self.data['T'].iloc[-2])
-                / (self.params.t - self.data['t'].iloc[-2]) * UNITS.s / UNITS.K9,
+                self.kawano.heading[3]: (self.params.T - self.history['T'][-2])
+                / (self.params.t - self.history['t'][-2]) * UNITS.s / UNITS.K9,
                 self.kawano.heading[4]: self.params.rho / UNITS.g_cm3,
                 self.kawano.heading[5]: self.params.H * UNITS.s
             }
@@ -293,8 +539,8 @@ class Universe(object):
             row.update({self.kawano.heading[i]: rate / UNITS.MeV**5
                         for i, rate in enumerate(rates, 6)})
 
-            self.kawano_data = self.kawano_data.append(row, ignore_index=True)
-            log_entry = "\t".join("{:e}".format(item) for item in self.kawano_data.iloc[-1])
+            self.kawano_history.append(row)
+            log_entry = "\t".join("{:e}".format(row[column]) for column in self.kawano.heading)
 
             print "KAWANO", log_entry
             self.kawano_log.write(log_entry + "\n")
@@ -30,9 +30,9 @@ class DistributionFunctional(object):
         for i, particle in enumerate(self.reaction):
             if skip_index is None or i != skip_index:
                 if particle.side == -1:
-                    temp *= particle.specie.distribution(p[i])
+                    temp *= particle.specie.distribution_array(p[i])
                 else:
-                    temp *= 1. - particle.specie.eta * particle.specie.distribution(p[i])
+                    temp *= 1. - particle.specie.eta * particle.specie.distribution_array(p[i])
 
         return temp
 
@@ -51,9 +51,9 @@ class DistributionFunctional(object):
         for i, particle in enumerate(self.reaction):
             if skip_index is None or i != skip_index:
                 if particle.side == 1:
-                    temp *= particle.specie.distribution(p[i])
+                    temp *= particle.specie.distribution_array(p[i])
                 else:
-                    temp *= 1. - particle.specie.eta * particle.specie.distribution(p[i])
+                    temp *= 1. - particle.specie.eta * particle.specie.distribution_array(p[i])
 
         return temp
 
@@ -86,6 +86,52 @@ class DistributionFunctional(object):
         """ Constant part of the distribution functional """
         return self.F_B(p=p, skip_index=0)
 
+    def F_linearized(self, p):
+        """ Constant and variable parts of the distribution functional `F_1` and `F_f` stacked\
+            along the first axis. Distribution functions are looked up once for both parts. """
+        F_A = -1.
+        F_B = 1.
+
+        for particle, momentum in zip(self.reaction[1:], p[1:]):
+            f = particle.specie.distribution_array(momentum)
+            if particle.side == -1:
+                F_A *= f
+                F_B *= 1. - particle.specie.eta * f
+            else:
+                F_A *= 1. - particle.specie.eta * f
+                F_B *= f
+
+        return numpy.array([F_B, F_A - self.particle.eta * F_B])
+
+    def F_derivative(self, p, index):
+        """ Derivative of the distribution functional over the distribution function of the\
+            particle `index` of the reaction. `F_f` is the derivative over $f_1$. """
+        eta = self.reaction[index].specie.eta
+        if self.reaction[index].side == -1:
+            return self.F_A(p=p, skip_index=index) - eta * self.F_B(p=p, skip_index=index)
+        return self.F_B(p=p, skip_index=index) - eta * self.F_A(p=p, skip_index=index)
+
+    def F_jacobian(self, p):
+        """ Derivatives of the distribution functional over the values of the distribution\
+            function of `particle` on its grid stacked along the first axis. All particles of\
+            the reaction of the same species contribute through the interpolation of the\
+            distribution function between the grid points. """
+        p = numpy.broadcast_arrays(*[numpy.asarray(momentum, dtype=numpy.float_)
+                                     for momentum in p])
+        points = numpy.arange(p[0].size)
+        jacobian = numpy.zeros((len(self.particle.grid.TEMPLATE), p[0].size))
+
+        for i, particle in enumerate(self.reaction):
+            if particle.specie is not self.particle:
+                continue
+
+            derivative = numpy.ravel(self.F_derivative(p, i))
+            index, low, high = particle.specie.distribution_derivatives(p[i].ravel())
+            jacobian[index, points] += derivative * low
+            jacobian[index + 1, points] += derivative * high
+
+        return jacobian.reshape(jacobian.shape[:1] + p[0].shape)
+
 
 class BoltzmannIntegral(PicklableObject, DistributionFunctional):
 
@@ -140,8 +186,6 @@ class BoltzmannIntegral(PicklableObject, DistributionFunctional):
         if not self.Ms:
             self.Ms = []
 
-        self.integrand = numpy.vectorize(self.integrand, otypes=[numpy.float_])
-
     def __str__(self):
         """ String-like representation of the integral. Corresponds to the first particle """
         return (
@@ -162,15 +206,23 @@ class BoltzmannIntegral(PicklableObject, DistributionFunctional):
         """
         raise NotImplementedError()
 
-    def calculate_kinematics(self, p):
-        """ Helper procedure that caches conformal energies and masses of the reaction """
+    def calculate_kinematics(self, p, m=None):
+        """ Helper procedure that caches conformal energies and masses of the reaction
+
+            :param m: Conformal masses to use instead of the current ones of the particles
+        """
         particle_count = len(self.reaction)
         p = (p + [0.]*particle_count)[:particle_count]
         E = []
-        m = []
-        for i, particle in enumerate(self.reaction):
-            E.append(particle.specie.conformal_energy(p[i]))
-            m.append(particle.specie.conformal_mass)
+        if m is None:
+            m = []
+            for i, particle in enumerate(self.reaction):
+                E.append(particle.specie.conformal_energy(p[i]))
+                m.append(particle.specie.conformal_mass)
+        else:
+            m = list(m)
+            for i in range(particle_count):
+                E.append(numpy.sqrt(p[i]**2 + m[i]**2) if m[i] else numpy.absolute(p[i]))
 
         """ Parameters of one particle can be inferred from the energy conservation law
             \begin{equation}E_3 = -s_3 \sum_{i \neq 3} s_i E_i \end{equation} """
@@ -181,12 +233,10 @@ class BoltzmannIntegral(PicklableObject, DistributionFunctional):
 
     def rates(self):
         def forward_integral(p):
-            return numpy.vectorize(lambda p0: p0**2 / (2 * numpy.pi)**3
-                                   * self.integrate(p0, self.F_A)[0])(p)
+            return p**2 / (2 * numpy.pi)**3 * self.integrate(p, self.F_A)
 
         def backward_integral(p):
-            return numpy.vectorize(lambda p0: p0**2 / (2 * numpy.pi)**3
-                                   * self.integrate(p0, self.F_B)[0])(p)
+            return p**2 / (2 * numpy.pi)**3 * self.integrate(p, self.F_B)
 
         grid = self.particle.grid
 
@@ -206,15 +256,65 @@ class BoltzmannIntegral(PicklableObject, DistributionFunctional):
     def integrate(p0, integrand, bounds=None, kwargs=None):
         raise NotImplementedError()
 
+    def linearized(self, p0):
+        """ Constant `A` and variable `B` parts of the linearized collision integral for a\
+            momentum `p0` or for an array of momenta. Both parts share the kinematics, so they\
+            are integrated at once with the stacked functional `F_linearized`. The adaptive\
+            quadrature integrates scalar functions only and computes them one by one. """
+        if integrators.QUADRATURE_TOLERANCE:
+            return self.integrate(p0, self.F_1), self.integrate(p0, self.F_f)
+
+        A, B = self.integrate(p0, self.F_linearized)
+        return A, B
+
+    def jacobian(self, p0):
+        """ Jacobian of the collision integral at the momenta `p0` over the distribution function\
+            of `particle` on its grid: `J[i, j]` is the derivative of the integral at `p0[i]`\
+            over the value at the grid point `j`. For `p0` on the grid its diagonal includes\
+            the variable part `B` of `linearized`. The adaptive quadrature integrates the\
+            columns one by one. """
+        p0 = numpy.asarray(p0, dtype=numpy.float_)
+
+        if integrators.QUADRATURE_TOLERANCE:
+            jacobian = numpy.array([
+                self.integrate(p0, lambda p, j=j: self.F_jacobian(p)[j])
+                for j in range(len(self.particle.grid.TEMPLATE))
+            ])
+        else:
+            jacobian = self.integrate(p0, self.F_jacobian)
+
+        return numpy.rollaxis(jacobian, 0, jacobian.ndim)
+
     def integrand(self, *args, **kwargs):
         """ Collision integral interior. """
         raise NotImplementedError()
 
     """ ### Integration region bounds methods """
 
+    # Regions and margins narrower than this fraction of the range are due to rounding errors,\
+    # e.g. the measure-zero regions of the particles at rest
+    REGION_TOLERANCE = 1e-9
+
     def in_bounds(self, p, E=None, m=None):
         raise NotImplementedError()
 
+    def allowed(self, p, masses=None):
+        """ Kinematically allowed points of the broadcastable arrays of momenta `p`, the last\
+            momentum of the reaction is inferred from the energy conservation law """
+        p = list(numpy.broadcast_arrays(*p))
+        p, E, m = self.calculate_kinematics(p + [numpy.zeros(p[0].shape)], masses)
+        return self.in_bounds(p, E, m)
+
+    def region(self, p, lower, upper, masses=None):
+        """ Tight bounds of the kinematically allowed range of the momentum next to the known\
+            ones `p` within `[lower, upper]`. Momenta and bounds are broadcastable arrays.
+
+            :param masses: Conformal masses of the reaction, current ones by default
+            :returns: lower and upper bounds of the allowed region, empty regions collapse to\
+                      `lower`
+        """
+        raise NotImplementedError()
+
     def bounds(self, p0):
         """ Coarse integration region based on the `self.particle.grid` points.
             Assumes that integration region is connected. """
@@ -241,10 +341,12 @@ class BoltzmannIntegral(PicklableObject, DistributionFunctional):
     def upper_bound(self, p0, p1):
         """ Find the last `self.particle.grid` point in the integration region """
 
-        index = int(
-            (min(p0 + p1, self.particle.grid.MAX_MOMENTUM) - self.particle.grid.MIN_MOMENTUM)
-            / self.particle.grid.MOMENTUM_STEP
-        )
+        # The grid is not uniform, the last point not exceeding $p_0 + p_1$ is found by bisection
+        index = numpy.searchsorted(
+            self.particle.grid.TEMPLATE,
+            min(p0 + p1, self.particle.grid.MAX_MOMENTUM),
+            side='right'
+        ) - 1
 
         while index >= 0 and not self.in_bounds([p0, p1, self.particle.grid.TEMPLATE[index]]):
             index -= 1
@@ -1,8 +1,17 @@
+import numpy
 
 
 def D(p, E, m, M=None, reaction=None):
     """ Dimensionality: energy """
+    return _D(p, E, m, M, reaction, D1, D2, D3)
 
+
+def D_array(p, E, m, M=None, reaction=None):
+    """ `D` evaluated on broadcastable arrays of momenta and energies """
+    return _D(p, E, m, M, reaction, D1_array, D2_array, D3_array)
+
+
+def _D(p, E, m, M, reaction, D1, D2, D3):
     i, j, k, l = M.order
     sksl = reaction[k].side * reaction[l].side
     sisjsksl = reaction[i].side * reaction[j].side * reaction[k].side * reaction[l].side
@@ -132,7 +141,15 @@ def D3(k1, k2, k3, k4):
 
 def Db(p, E, m, M=None, reaction=None):
     """ Dimensionality: energy """
+    return _Db(p, E, m, M, reaction, Db1, Db2)
+
+
+def Db_array(p, E, m, M=None, reaction=None):
+    """ `Db` evaluated on broadcastable arrays of momenta and energies """
+    return _Db(p, E, m, M, reaction, Db1_array, Db2_array)
 
+
+def _Db(p, E, m, M, reaction, Db1, Db2):
     i, j, k, l = M.order
     sisj = reaction[i].side * reaction[j].side
     sksl = reaction[k].side * reaction[l].side
@@ -176,3 +193,124 @@ def Db2(q2, q3, q4):
     if (q2 + q3 > q4) and (q2 + q4 > q3) and (q3 + q4 > q2):
         return 0.5 * (q3**2 + q4**2 - q2**2)
     return 0.
+
+
+""" ### Array versions
+
+    Collision integrands are evaluated on the whole quadrature mesh at once, so the $D$-functions\
+    are also provided in a form accepting broadcastable arrays of momenta. Kinematic cases of the\
+    scalar versions are selected with masks, expressions are kept identical to give bit-compatible\
+    results. """
+
+
+# Scalar `**` resolves to the C `pow`, while NumPy `**` takes shortcuts (e.g. squaring) that can\
+# differ in the last bit
+_pow = numpy.float_power
+
+
+def _sort_momenta(k1, k2, k3, k4):
+    k1, k2, k3, k4 = numpy.broadcast_arrays(*(numpy.asarray(k, dtype=float)
+                                              for k in (k1, k2, k3, k4)))
+    return (numpy.maximum(k1, k2), numpy.minimum(k1, k2),
+            numpy.maximum(k3, k4), numpy.minimum(k3, k4))
+
+
+def _kinematic_cases(q1, q2, q3, q4):
+    """ Masks of the four kinematic cases and of the region where $D$-functions vanish """
+    outside = (q1 > q2 + q3 + q4) | (q3 > q2 + q1 + q4)
+    left = q1 + q2 >= q3 + q4
+    right = q1 + q4 >= q2 + q3
+    return outside, [left & right, left & ~right, ~left & right, ~left & ~right]
+
+
+def D1_array(k1, k2, k3, k4):
+    """ Array version of `D1` """
+
+    q1, q2, q3, q4 = _sort_momenta(k1, k2, k3, k4)
+    outside, cases = _kinematic_cases(q1, q2, q3, q4)
+
+    result = numpy.select(cases, [
+        0.5 * (-q1 + q2 + q3 + q4),
+        q4,
+        q2,
+        0.5 * (q1 + q2 - q3 + q4)
+    ])
+
+    return numpy.where(outside, 0., result)
+
+
+def D2_array(k1, k2, k3, k4):
+    """ Array version of `D2` """
+
+    q1, q2, q3, q4 = _sort_momenta(k1, k2, k3, k4)
+    outside, cases = _kinematic_cases(q1, q2, q3, q4)
+
+    a = q1 - q2
+    b = q1 + q2
+
+    result = numpy.select(cases, [
+        (
+            a * (_pow(a, 2) - 3. * (_pow(q3, 2) + _pow(q4, 2))) + 2. * (_pow(q3, 3) + _pow(q4, 3))
+        ) / 12.,
+        _pow(q4, 3) / 3.,
+        q2 * (3. * (_pow(q3, 2) + _pow(q4, 2) - _pow(q1, 2)) - _pow(q2, 2)) / 6.,
+        (
+            b * (3. * (_pow(q3, 2) + _pow(q4, 2)) - _pow(b, 2)) + 2. * (_pow(q4, 3) - _pow(q3, 3))
+        ) / 12.
+    ])
+
+    return numpy.where(outside, 0., result)
+
+
+def D3_array(k1, k2, k3, k4):
+    """ Array version of `D3` """
+
+    q1, q2, q3, q4 = _sort_momenta(k1, k2, k3, k4)
+    outside, cases = _kinematic_cases(q1, q2, q3, q4)
+
+    result = numpy.select(cases, [
+        (
+            _pow(q1, 5) - _pow(q2, 5) - _pow(q3, 5) - _pow(q4, 5)
+            + 5. * (
+                _pow(q1, 2) * _pow(q2, 2) * (q2 - q1)
+                + _pow(q3, 2) * (_pow(q2, 3) - _pow(q1, 3) + (_pow(q2, 2) + _pow(q1, 2)) * q3)
+                + _pow(q4, 2) * (
+                    _pow(q2, 3) - _pow(q1, 3) + _pow(q3, 3)
+                    + (_pow(q1, 2) + _pow(q2, 2) + _pow(q3, 2)) * q4
+                )
+            )
+        ) / 60.,
+        _pow(q4, 3) * (5. * (_pow(q1, 2) + _pow(q2, 2) + _pow(q3, 2)) - _pow(q4, 2)) / 30.,
+        _pow(q2, 3) * (5. * (_pow(q1, 2) + _pow(q3, 2) + _pow(q4, 2)) - _pow(q2, 2)) / 30.,
+        (
+            _pow(q3, 5) - _pow(q4, 5) - _pow(q1, 5) - _pow(q2, 5)
+            + 5. * (
+                _pow(q3, 2) * _pow(q4, 2) * (q4 - q3)
+                + _pow(q1, 2) * (_pow(q4, 3) - _pow(q3, 3) + (_pow(q4, 2) + _pow(q3, 2)) * q1)
+                + _pow(q2, 2) * (
+                    _pow(q4, 3) - _pow(q3, 3) + _pow(q1, 3)
+                    + (_pow(q1, 2) + _pow(q3, 2) + _pow(q4, 2)) * q2
+                )
+            )
+        ) / 60.
+    ])
+
+    return numpy.where(outside, 0., result)
+
+
+def _triangle(q2, q3, q4):
+    q2, q3, q4 = numpy.broadcast_arrays(*(numpy.asarray(q, dtype=float)
+                                          for q in (q2, q3, q4)))
+    return q2, q3, q4, (q2 + q3 > q4) & (q2 + q4 > q3) & (q3 + q4 > q2)
+
+
+def Db1_array(q2, q3, q4):
+    """ Array version of `Db1` """
+    q2, q3, q4, inside = _triangle(q2, q3, q4)
+    return numpy.where(inside, 1., 0.)
+
+
+def Db2_array(q2, q3, q4):
+    """ Array version of `Db2` """
+    q2, q3, q4, inside = _triangle(q2, q3, q4)
+    return numpy.where(inside, 0.5 * (_pow(q3, 2) + _pow(q4, 2) - _pow(q2, 2)), 0.)
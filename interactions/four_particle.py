@@ -1,8 +1,28 @@
 # -*- coding: utf-8 -*-
 import numpy
-from common import integrators
+from collections import namedtuple
+from common import integrators, utils
 from interactions.boltzmann import BoltzmannIntegral
-from interactions.ds import D, Db
+from interactions.ds import D_array, Db_array
+
+
+""" Collision kernel: momenta of the quadrature points with a non-zero contribution, their\
+    weights and the indices of the corresponding `p0` """
+Kernel = namedtuple('Kernel', ['momenta', 'weights', 'index'])
+
+
+def kernel_size(kernel):
+    """ Memory footprint of the collision kernel arrays in bytes """
+    return sum(array.nbytes for array in kernel.momenta + [kernel.weights, kernel.index])
+
+
+# Step of the logarithmic scale the conformal masses are rounded to when looking up the kernels,\
+# exact masses if `0`: kernels of massive reactions are then rebuilt on every step
+MASS_TOLERANCE = float(utils.getenv('KERNEL_MASS_TOLERANCE', 0))
+
+# Collision kernels by `FourParticleIntegral.signature()`, quantized masses and momenta
+kernels = utils.LRUCache(budget=float(utils.getenv('KERNEL_CACHE_SIZE', 256)) * 1024**2,
+                         sizeof=kernel_size)
 
 
 class FourParticleM(object):
@@ -74,6 +94,9 @@ class FourParticleM(object):
 
 class FourParticleIntegral(BoltzmannIntegral):
 
+    # Largest error estimate of the last integration in the adaptive quadrature mode
+    quadrature_error = numpy.nan
+
     def __init__(self, **kwargs):
         super(FourParticleIntegral, self).__init__(**kwargs)
 
@@ -89,76 +112,320 @@ class FourParticleIntegral(BoltzmannIntegral):
             self.particle.collision_integrals.append(self)
 
     def integrate(self, p0, fau=None, bounds=None):
-        if bounds is None:
-            bounds = (
-                self.grids[0].BOUNDS,
-                (lambda p1: self.grids[1].MIN_MOMENTUM,
-                 lambda p1: min(p0 + p1, self.grids[1].MAX_MOMENTUM)),
-            )
+        """ Integrate the collision integrand over $p_1$ and $p_2$ for a momentum `p0` or for an\
+            array of momenta at once. The distribution functional `fau` is contracted with the\
+            collision kernel of the momenta in a single batch of array operations.
 
-        @numpy.vectorize
-        def prepared_integrand(p1, p2):
-            return self.integrand(p0, p1, p2, fau)
+            Functionals may return several stacked values for every point, e.g. `F_linearized`,\
+            the integrals are then stacked along the leading axes of the result. """
+        p0 = numpy.asarray(p0, dtype=numpy.float_)
+
+        if integrators.QUADRATURE_TOLERANCE:
+            integral = self.adaptive_integral(p0, fau, bounds).reshape(p0.shape)
+        else:
+            kernel = self.kernel(p0, bounds)
+            values = kernel.weights * fau(kernel.momenta)
+            integral = numpy.zeros(values.shape[:-1] + (p0.size,))
+            # Kernels of the momenta below the reaction threshold have no points
+            for row in numpy.ndindex(values.shape[:-1]):
+                integral[row] = numpy.bincount(kernel.index, weights=values[row],
+                                               minlength=p0.size)
+            integral = integral.reshape(values.shape[:-1] + p0.shape)
 
         params = self.particle.params
         constant = (params.m / params.x)**5 / 64. / numpy.pi**3
-        integral, error = integrators.integrate_2D(
-            prepared_integrand,
-            bounds=bounds
-        )
 
         return constant * integral
 
+    def adaptive_integral(self, p0, fau, bounds=None):
+        """ Integrals for the array of momenta `p0` computed one by one with the adaptive\
+            quadrature of `integrators.QUADRATURE_TOLERANCE`. The region is subdivided at\
+            $p_1 = p_{max} - p_0$ where the upper bound of $p_2$ has a kink. The largest error\
+            estimate is kept in `quadrature_error`. """
+        integral = numpy.zeros(p0.size)
+        self.quadrature_error = 0.
+
+        for i, p0_i in enumerate(p0.ravel()):
+            points = ()
+            bounds_i = bounds
+            if bounds is None:
+                MIN, MAX = self.grids[1].MIN_MOMENTUM, self.grids[1].MAX_MOMENTUM
+                bounds_i = (
+                    self.grids[0].BOUNDS,
+                    (lambda p1: MIN, lambda p1, p0_i=p0_i: min(p0_i + p1, MAX))
+                )
+                points = (MAX - p0_i,)
+
+            integral[i], error = integrators.integrate_2D(
+                lambda p1, p2, p0_i=p0_i: self.integrand(p0_i, p1, p2, fau),
+                bounds_i, points=points
+            )
+            self.quadrature_error = max(self.quadrature_error, error)
+
+        return integral
+
+    """ ### Collision kernel
+
+        The part of the integrand that does not depend on the distribution functions - quadrature\
+        nodes and weights, $D$-functions and jacobians - is the collision kernel. For reactions of\
+        massless particles it is only a function of the grids and matrix elements, so it is\
+        computed once and reused on every step.
+
+        Kernels of massive particles depend on the conformal masses $M a$ that change with the\
+        scale factor, so by default they are rebuilt on every step and are not stored. With the\
+        `KERNEL_MASS_TOLERANCE` environment variable the masses are rounded to the\
+        `MASS_TOLERANCE` steps of a logarithmic scale, and the same kernel serves all the steps\
+        until any of the masses moves to the next step. The relative error of the masses is then\
+        at most `MASS_TOLERANCE / 2`, but the error of the integral is much larger close to the\
+        kinematic thresholds: at $T = 0.1$ MeV a $0.3\%$ shift of the electron mass changes the\
+        $\nu \overline{\nu} \leftrightarrow e^+ e^-$ integral by up to $15\%$. Kernels are reused\
+        only if the tolerance exceeds the change of $\ln a$ per step, `params.dy`.
+
+        Kernels are stored in the least recently used cache limited by `KERNEL_CACHE_SIZE`\
+        megabytes. """
+
+    def quantized_masses(self):
+        """ Conformal masses of the reaction rounded to the `MASS_TOLERANCE` steps
+
+            :returns: hashable key of the rounded masses and the masses themselves
+        """
+        keys = []
+        masses = []
+        for item in self.reaction:
+            mass = item.specie.conformal_mass
+            if mass == 0 or not MASS_TOLERANCE:
+                keys.append(None if mass == 0 else mass)
+                masses.append(mass)
+            else:
+                key = int(numpy.round(numpy.log(mass) / MASS_TOLERANCE))
+                keys.append(key)
+                masses.append(numpy.exp(key * MASS_TOLERANCE))
+        return tuple(keys), masses
+
+    def signature(self):
+        """ Hashable description of everything the collision kernel depends on """
+        return (
+            tuple((item.specie.name, item.specie.mass, item.side, item.antiparticle, item.crossed)
+                  for item in self.reaction),
+            tuple((M.K1, M.K2, M.order) for M in self.Ms),
+            tuple((grid.MIN_MOMENTUM, grid.MAX_MOMENTUM) for grid in self.grids),
+            integrators.GAUSS_LEGENDRE_ORDER
+        )
+
+    def kernel(self, p0, bounds=None):
+        """ Collision kernel for the momenta `p0`. Kernels of the default integration region are\
+            looked up in the cache and built on demand. Kernels of the exact non-zero masses\
+            would never be reused and are not cached. """
+        if bounds is not None:
+            return self.build_kernel(p0, bounds)
+
+        mass_key, masses = self.quantized_masses()
+        if not MASS_TOLERANCE and any(key is not None for key in mass_key):
+            return self.build_kernel(p0, masses=masses)
+
+        key = (self.signature(), mass_key, p0.shape, p0.tostring())
+
+        kernel = kernels.get(key)
+        if kernel is None:
+            kernel = self.build_kernel(p0, masses=masses)
+            kernels[key] = kernel
+        return kernel
+
+    def build_kernel(self, p0, bounds=None, masses=None):
+        """ Evaluate the collision kernel on the quadrature nodes of the integration region.\
+            Only the points with a non-zero contribution are kept.
+
+            :param masses: Conformal masses of the reaction, current ones by default
+        """
+        p0_mesh = p0[..., numpy.newaxis, numpy.newaxis]
+
+        if bounds is None:
+            bounds = self.default_bounds(p0_mesh, masses)
+
+        (a, b), (g, h) = bounds
+        p1, p2, weights = integrators.quadrature((a, b)).transform(g, h)
+
+        index = numpy.arange(p0.size).reshape(p0.shape)[..., numpy.newaxis, numpy.newaxis]
+
+        p0_mesh, p1, p2, weights, index = numpy.broadcast_arrays(p0_mesh, p1, p2, weights, index)
+
+        allowed, p, values = self.kernel_values(p0_mesh, p1, p2, masses)
+        nonzero = values != 0
+
+        return Kernel(
+            momenta=[momentum[nonzero] for momentum in p],
+            weights=values[nonzero] * weights[allowed][nonzero],
+            index=index[allowed][nonzero]
+        )
+
+    def default_bounds(self, p0, masses=None):
+        """ Integration region of the collision kernel: $p_1$ over its grid and $p_2$ over the\
+            kinematically allowed part of $[p_{min}, \min(p_0 + p_1, p_{max})]$, so that the\
+            quadrature nodes are not wasted on the points where the $D$-functions vanish.
+
+            :param masses: Conformal masses of the reaction, current ones by default
+        """
+        MIN, MAX = self.grids[1].MIN_MOMENTUM, self.grids[1].MAX_MOMENTUM
+        regions = {}
+
+        def region(p1):
+            key = p1.tostring()
+            if key not in regions:
+                regions[key] = self.region([p0, p1], MIN, numpy.minimum(p0 + p1, MAX), masses)
+            return regions[key]
+
+        return (
+            self.grids[0].BOUNDS,
+            (lambda p1: region(p1)[0], lambda p1: region(p1)[1])
+        )
+
     def integrand(self, p0, p1, p2, fau=None):
 
         """
-        Collision integral interior.
+        Collision integral interior evaluated on broadcastable arrays of momenta.
+
+        Only the kinematically allowed points are passed further to the $D$-functions and the\
+        distribution functional.
         """
 
+        p0, p1, p2 = numpy.broadcast_arrays(p0, p1, p2)
+        integrand = numpy.zeros(p0.shape)
+
+        allowed, p, values = self.kernel_values(p0, p1, p2)
+
+        nonzero = values != 0
+        values[nonzero] *= fau([momentum[nonzero] for momentum in p])
+
+        integrand[allowed] = values
+
+        return integrand
+
+    def kernel_values(self, p0, p1, p2, masses=None):
+        """ $D$-functions and jacobians of the kinematically allowed points of the arrays of\
+            momenta `p0`, `p1` and `p2` of the same shape.
+
+            :param masses: Conformal masses of the reaction, current ones by default
+            :returns: the mask of allowed points, momenta and the kernel values at those points
+        """
         p = [p0, p1, p2, 0]
-        p, E, m = self.calculate_kinematics(p)
+        p, E, m = self.calculate_kinematics(p, masses)
+
+        allowed = self.in_bounds(p, E, m)
 
-        if not self.in_bounds(p, E, m):
-            return 0.
+        p = [momentum[allowed] for momentum in p]
+        E = [energy[allowed] for energy in E]
 
-        integrand = 1.
+        ds = numpy.zeros(p[0].shape)
 
-        ds = 0.
-        if p[0] != 0:
+        moving = p[0] != 0
+        if moving.any():
+            p_moving = [momentum[moving] for momentum in p]
+            E_moving = [energy[moving] for energy in E]
+            ds_moving = 0.
             for M in self.Ms:
-                ds += D(p=p, E=E, m=m, M=M, reaction=self.reaction)
-            ds = ds / p[0] / E[0]
-        else:
+                ds_moving += D_array(p=p_moving, E=E_moving, m=m, M=M, reaction=self.reaction)
+            ds[moving] = ds_moving / p_moving[0] / E_moving[0]
+
+        resting = ~moving
+        if resting.any():
+            p_resting = [momentum[resting] for momentum in p]
+            E_resting = [energy[resting] for energy in E]
+            ds_resting = 0.
             for M in self.Ms:
-                ds += Db(p=p, E=E, m=m, M=M, reaction=self.reaction)
-        integrand *= ds
+                ds_resting += Db_array(p=p_resting, E=E_resting, m=m, M=M, reaction=self.reaction)
+            ds[resting] = ds_resting
+
+        values = ds
 
         # Avoid rounding errors and division by zero
         for i in [1, 2, 3]:
             if m[i] != 0:
-                integrand *= p[i] / E[i]
+                values *= p[i] / E[i]
 
-        if integrand == 0:
-            return 0
-
-        integrand *= fau(p)
-
-        return integrand
+        return allowed, p, values
 
     """ ### Integration region bounds methods """
 
+    def region(self, p, lower, upper, masses=None):
+        """ Exact kinematically allowed range of $p_2$ for the momenta $p_0$ and $p_1$ in `p`\
+            within `[lower, upper]`. The energy of the last particle is linear in $E_2$
+
+            \begin{equation}
+                E_3 = C + t E_2, \quad C = -s_3 (s_0 E_0 + s_1 E_1), \quad t = -s_3 s_2
+            \end{equation}
+
+            so the boundaries of the conditions of `in_bounds` are the solutions of\
+            $E_3 = \pm m_3$ and of the triangle inequalities turned into equalities\
+            $p_3 = a + b p_2$ with $(a, b)$ one of $(|p_0 - p_1|, -1)$, $(\pm (p_0 + p_1), 1)$.\
+            The latter are linear in $E_2$ and $p_2$
+
+            \begin{equation}
+                2 t C E_2 - 2 a b p_2 = a^2 - C^2 - m_2^2 + m_3^2
+            \end{equation}
+
+            and turn into a quadratic equation in $p_2$. The roots split `[lower, upper]` into\
+            the intervals where the conditions do not change, the middle points of the intervals\
+            tell which ones are allowed. Spurious roots of the squared equations only split the\
+            intervals further. The returned range spans all the allowed intervals, so a region\
+            that is not connected is still covered and the forbidden points in between are\
+            masked by `in_bounds`. Intervals narrower than `REGION_TOLERANCE` are rounding\
+            artifacts and are skipped.
+
+            :param masses: Conformal masses of the reaction, current ones by default
+            :returns: lower and upper bounds of the allowed region, empty regions collapse to\
+                      `lower`
+        """
+        arrays = numpy.broadcast_arrays(*[numpy.asarray(x, dtype=numpy.float_)
+                                          for x in [lower, upper] + list(p)])
+        lower, upper, p0, p1 = arrays
+        m = masses if masses is not None else [item.specie.conformal_mass
+                                               for item in self.reaction]
+        s = [item.side for item in self.reaction]
+
+        C = -s[3] * (s[0] * numpy.sqrt(p0**2 + m[0]**2) + s[1] * numpy.sqrt(p1**2 + m[1]**2))
+        t = -s[3] * s[2]
+
+        points = [lower, upper]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for sign in [1., -1.]:
+                E2 = t * (sign * m[3] - C)
+                points.append(numpy.where(E2 >= 0, numpy.sqrt(E2**2 - m[2]**2), numpy.nan))
+
+            for a, b in [(numpy.abs(p0 - p1), -1.), (-(p0 + p1), 1.), (p0 + p1, 1.)]:
+                A, B, R = 2. * t * C, -2. * a * b, a**2 - C**2 - m[2]**2 + m[3]**2
+                q2, q1, q0 = A**2 - B**2, 2. * R * B, A**2 * m[2]**2 - R**2
+                # Numerically stable roots, a single one if the equation is linear
+                root = -(q1 + numpy.where(q1 >= 0, 1., -1.) * numpy.sqrt(q1**2 - 4. * q2 * q0)) / 2.
+                points += [q0 / root, root / q2]
+
+            points = numpy.array(numpy.broadcast_arrays(*points))
+            points = numpy.where(numpy.isfinite(points) & (points >= lower) & (points <= upper),
+                                 points, lower)
+        points = numpy.sort(numpy.rollaxis(points, 0, points.ndim), axis=-1)
+
+        left, right = points[..., :-1], points[..., 1:]
+        allowed = self.allowed([p0[..., numpy.newaxis], p1[..., numpy.newaxis],
+                                (left + right) / 2.], masses)
+        allowed &= right - left > self.REGION_TOLERANCE * (upper - lower)[..., numpy.newaxis]
+
+        empty = ~allowed.any(axis=-1)
+        start = numpy.where(allowed, left, numpy.inf).min(axis=-1)
+        end = numpy.where(allowed, right, -numpy.inf).max(axis=-1)
+
+        return numpy.where(empty, lower, start), numpy.where(empty, lower, end)
+
     def in_bounds(self, p, E=None, m=None):
         """ $D$-functions involved in the interactions imply a cut-off region for the collision\
             integrand. In the general case of arbitrary particle masses, this is a set of \
             irrational inequalities that can hardly be solved (at least, Wolfram Mathematica does\
-            not succeed in this). To avoid excessive computations, it is convenient to do an early\
-            `return 0` when the particles kinematics lay out of the cut-off region """
+            not succeed in this). To avoid excessive computations, it is convenient to skip the\
+            points where the particles kinematics lay out of the cut-off region """
         if not E or not m:
             p, E, m = self.calculate_kinematics(p)
 
-        q1, q2 = (p[0], p[1]) if p[0] > p[1] else (p[1], p[0])
-        q3, q4 = (p[2], p[3]) if p[2] > p[3] else (p[3], p[2])
+        q1, q2 = numpy.maximum(p[0], p[1]), numpy.minimum(p[0], p[1])
+        q3, q4 = numpy.maximum(p[2], p[3]), numpy.minimum(p[2], p[3])
 
-        is_in = (E[3] >= m[3] and q1 <= q2 + q3 + q4 and q3 <= q1 + q2 + q4)
+        is_in = (E[3] >= m[3]) & (q1 <= q2 + q3 + q4) & (q3 <= q1 + q2 + q4)
 
         return is_in
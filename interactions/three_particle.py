@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import math
 import numpy
-import operator
 from common import integrators
 from interactions.boltzmann import BoltzmannIntegral
 
@@ -51,37 +50,63 @@ class ThreeParticleIntegral(BoltzmannIntegral):
             self.particle.collision_integrals.append(self)
 
     def integrate(self, p0, fau=None, bounds=None):
-        if p0 == 0:
-            return self.rest_integral(fau)
+        """ Integrate the collision integrand over $p_1$ for a momentum `p0` or for an array of\
+            momenta at once. The integrand of all moving `p0` is evaluated on the quadrature\
+            nodes in a single batch of array operations. Nodes are placed only in the exact\
+            kinematically allowed `region` of every `p0`.
 
-        if bounds is None:
-            bounds = (self.grids[0].MIN_MOMENTUM, self.grids[0].MAX_MOMENTUM)
-
-        def prepared_integrand(p1):
-            return self.integrand(p0, p1, fau)
+            Functionals may return several stacked values for every point, e.g. `F_linearized`,\
+            the integrals are then stacked along the leading axes of the result. """
+        p0 = numpy.asarray(p0, dtype=numpy.float_)
 
-        integral, error = integrators.integrate_1D(
-            prepared_integrand,
-            bounds=bounds
-        )
-        constant = self.particle.params.a / 16. / math.pi
-
-        return constant * integral
+        if bounds is None:
+            bounds = self.grids[0].BOUNDS
+
+        parts = []
+
+        moving = p0 != 0
+        if moving.any():
+            start, end = self.region([p0[moving]], bounds[0], bounds[1])
+
+            if integrators.QUADRATURE_TOLERANCE:
+                values = numpy.array([
+                    integrators.integrate_1D(
+                        lambda p1, p0_i=p0_i: self.integrand(p0_i, p1, fau),
+                        bounds=(start_i, end_i)
+                    )[0]
+                    for p0_i, start_i, end_i in zip(p0[moving], start, end)
+                ])
+            else:
+                # Nodes of the unit interval are mapped onto the allowed region of each `p0`
+                quadrature = integrators.quadrature((0., 1.))
+                p1 = start[:, numpy.newaxis] + (end - start)[:, numpy.newaxis] * quadrature.nodes
+                values = (end - start) * quadrature.integrate(
+                    self.integrand(p0[moving][:, numpy.newaxis], p1, fau)
+                )
+            parts.append((moving, values * self.particle.params.a / 16. / math.pi))
+
+        if not moving.all():
+            parts.append((~moving, numpy.asarray(self.rest_integral(fau))[..., numpy.newaxis]))
+
+        shape = numpy.broadcast(*[values[..., :1] for _, values in parts]).shape[:-1]
+        integral = numpy.zeros(shape + p0.shape)
+        for mask, values in parts:
+            integral[..., mask] = values
+
+        return integral
 
     def rest_integral(self, fau=None):
         a = self.particle.params.a
-        m = [particle.specie.mass for particle in self.reaction]
+        m = numpy.array([particle.specie.mass for particle in self.reaction])
 
+        # Massless particles at rest do not interact
         if m[0] == 0:
-            return 0
+            return numpy.zeros(numpy.shape(fau([0., 0., 0.])))
 
-        signs = ((1, 1, 1), (1, -1, -1),
-                 (1, -1, 1), (1, 1, -1))
+        signs = numpy.array(((1, 1, 1), (1, -1, -1),
+                             (1, -1, 1), (1, 1, -1)))
 
-        p1 = a * math.sqrt(reduce(operator.mul, (
-            reduce(operator.add, map(operator.mul, m, sign))
-            for sign in signs
-        ))) / (2. * m[0])
+        p1 = a * math.sqrt(numpy.prod(numpy.dot(signs, m))) / (2. * m[0])
 
         p = [0, p1, 0]
         p, E, m = self.calculate_kinematics(p)
@@ -94,37 +119,103 @@ class ThreeParticleIntegral(BoltzmannIntegral):
     def integrand(self, p0, p1, fau=None):
 
         """
-        Collision integral interior.
+        Collision integral interior evaluated on broadcastable arrays of momenta.
+
+        Only the kinematically allowed points are passed further to the distribution functional.
         """
 
+        p0, p1 = numpy.broadcast_arrays(numpy.asarray(p0, dtype=numpy.float_),
+                                        numpy.asarray(p1, dtype=numpy.float_))
+
         p = [p0, p1, 0]
         p, E, m = self.calculate_kinematics(p)
 
-        integrand = self.in_bounds(p, E, m) * self.constant
+        allowed = self.in_bounds(p, E, m)
+
+        p = [momentum[allowed] for momentum in p]
+        E = [energy[allowed] for energy in E]
+
+        values = numpy.full(p[0].shape, self.constant)
 
-        if p[0] != 0:
-            integrand /= p[0] * E[0]
+        moving = p[0] != 0
+        values[moving] /= p[0][moving] * E[0][moving]
 
-            # Avoid rounding errors and division by zero
-            if m[1] != 0:
-                integrand *= p[1] / E[1]
-        else:
+        # Avoid rounding errors and division by zero
+        if m[1] != 0:
+            values[moving] *= p[1][moving] / E[1][moving]
+
+        resting = ~moving
+        if resting.any():
             if m[0] == 0:
-                integrand *= 0
-                return integrand
+                values[resting] = 0.
+            else:
+                values[resting] *= 2 * p[1][resting]**2
+                if m[1] != 0:
+                    values[resting] *= p[1][resting] / E[1][resting]
+                if m[2] != 0:
+                    values[resting] *= p[1][resting] / E[2][resting]
 
-            integrand *= 2 * p[1]**2
-            if m[1] != 0:
-                integrand *= p[1] / E[1]
-            if m[2] != 0:
-                integrand *= p[1] / E[2]
+        values = values * fau(p)
 
-        integrand *= numpy.array([fau([p[0], p[1][i], p[2][i]]) for i in range(len(p[1]))])
+        integrand = numpy.zeros(values.shape[:-1] + p0.shape)
+        integrand[..., allowed] = values
 
         return integrand
 
     """ ### Integration region bounds methods """
 
+    def region(self, p, lower, upper, masses=None):
+        """ Exact kinematically allowed range of $p_1$ for the momenta $p_0$ in `p` within\
+            `[lower, upper]`. For the two-body decay (or its inverse) with $E_2 = E_0 \mp E_1$ the\
+            conservation of the 4-momentum fixes the angle between $p_0$ and $p_1$
+
+            \begin{equation}
+                E_0 E_1 - p_0 p_1 \cos \theta = K, \quad
+                K = \sigma \frac{m_2^2 - m_0^2 - m_1^2}{2}
+            \end{equation}
+
+            where $\sigma = 1$ if the particles $0$ and $1$ are on the same side of the reaction\
+            and $-1$ otherwise. Condition $|E_0 E_1 - K| \le p_0 p_1$ is quadratic in $E_1$
+
+            \begin{equation}
+                m_0^2 E_1^2 - 2 K E_0 E_1 + K^2 + p_0^2 m_1^2 \le 0
+            \end{equation}
+
+            and gives the interval $E_1 \in [E_-, E_+]$ with $E_\pm = (K E_0 \pm p_0 \sqrt{K^2 -\
+            m_0^2 m_1^2}) / m_0^2$, or $E_1 \ge (K^2 + p_0^2 m_1^2) / 2 K p_0$ for $m_0 = 0$.
+
+            :param masses: Conformal masses of the reaction, current ones by default
+            :returns: lower and upper bounds of the allowed region, empty regions collapse to\
+                      `lower`
+        """
+        p0 = numpy.asarray(p[0], dtype=numpy.float_)
+        m = masses if masses is not None else [particle.specie.conformal_mass
+                                               for particle in self.reaction]
+
+        sigma = self.reaction[0].side * self.reaction[1].side
+        K = sigma * (m[2]**2 - m[0]**2 - m[1]**2) / 2.
+        discriminant = K**2 - m[0]**2 * m[1]**2
+
+        E0 = numpy.sqrt(p0**2 + m[0]**2)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            if K <= 0 or discriminant < 0:
+                E_min = E_max = numpy.full(p0.shape, numpy.nan)
+            elif m[0] == 0:
+                E_min = (K**2 + p0**2 * m[1]**2) / (2. * K * p0)
+                E_max = numpy.full(p0.shape, numpy.inf)
+            else:
+                E_min = (K * E0 - p0 * numpy.sqrt(discriminant)) / m[0]**2
+                E_max = (K * E0 + p0 * numpy.sqrt(discriminant)) / m[0]**2
+
+            start = numpy.sqrt(numpy.maximum(E_min**2 - m[1]**2, 0.))
+            end = numpy.sqrt(numpy.maximum(E_max**2 - m[1]**2, 0.))
+
+        start = numpy.maximum(start, lower)
+        end = numpy.minimum(end, upper)
+
+        empty = ~(start < end)
+        return numpy.where(empty, lower, start), numpy.where(empty, lower, end)
+
     def in_bounds(self, p, E=None, m=None):
         """ The kinematically allowed region in momentum space """
         if not E or not m:
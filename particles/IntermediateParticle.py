@@ -3,12 +3,15 @@ For intermediate regime equilibrium particles, density, energy density and press
 are obtained through integration of distribution function
 """
 
-from common import integrators
+from common import integrators, utils
 import numpy
 
 
 name = 'intermediate'
 
+# Interpolate the precomputed `particles.tables` instead of the quadrature over the momentum grid
+TABULATED = utils.getboolenv('TABULATED_THERMODYNAMICS', False)
+
 
 def density(particle):
     """ ## Particle density
@@ -17,15 +20,7 @@ def density(particle):
             g \int \frac{p^2 dp}{2 \pi^2} f\left( \frac{p}{T} \right)
         \end{equation}
     """
-    density, _ = integrators.integrate_1D(
-        lambda p: (
-            particle.equilibrium_distribution_function(
-                particle.energy(p) / particle.T
-            ) * p**2 * particle.dof / 2. / numpy.pi**2
-        ), (particle.grid.MIN_MOMENTUM / particle.params.a,
-            particle.grid.MAX_MOMENTUM / particle.params.a)
-    )
-    return density
+    return thermodynamics(particle, 'density')
 
 
 # ## Particle energy density
@@ -48,12 +43,7 @@ def energy_density(particle):
             \rho = \int dp I_\rho
         \end{equation}
     """
-    energy_density, _ = integrators.integrate_1D(
-        lambda p: energy_density_integrand(p, particle),
-        (particle.grid.MIN_MOMENTUM / particle.params.a,
-         particle.grid.MAX_MOMENTUM / particle.params.a)
-    )
-    return energy_density
+    return thermodynamics(particle, 'energy_density')
 
 
 # ## Particle pressure
@@ -76,12 +66,7 @@ def pressure(particle):
             P = \int dp I_P
         \end{equation}
     """
-    pressure, _ = integrators.integrate_1D(
-        lambda p: pressure_integrand(p, particle),
-        (particle.grid.MIN_MOMENTUM / particle.params.a,
-         particle.grid.MAX_MOMENTUM / particle.params.a)
-    )
-    return pressure
+    return thermodynamics(particle, 'pressure')
 
 
 # ## Master equation terms
@@ -110,6 +95,9 @@ def I(particle, y_power=2):
             { \left(e^{-\frac{E_N(y)}{a T}} + \eta \right)^2 }
         \end{equation}
     """
+    if y_power in (2, 4):
+        return thermodynamics(particle, 'I{}'.format(y_power))
+
     return particle.dof / 2. / numpy.pi**2 * integrators.integrate_1D(
         lambda y: (
             y**y_power * numpy.exp(-particle.conformal_energy(y) / particle.aT)
@@ -117,3 +105,144 @@ def I(particle, y_power=2):
         ),
         (particle.grid.MIN_MOMENTUM, particle.grid.MAX_MOMENTUM)
     )[0]
+
+
+# ## Batched thermodynamics
+
+# Thermodynamic integrals computed by `moments`
+MOMENTS = ('density', 'energy_density', 'pressure', 'I2', 'I4')
+
+
+def thermodynamics(particle, name):
+    """ Thermodynamic integral `name` of the particle at its current state, computed by\
+        `moments` only once per state of the particle """
+    key = (particle.aT, particle.params.a, particle.mass)
+    cached = getattr(particle, '_thermodynamics', None)
+    if cached is None or cached[0] != key or name not in cached[1]:
+        moments([particle])
+    return particle._thermodynamics[1][name]
+
+
+def moments(particles, aT=None, names=MOMENTS):
+    """ Density, energy density, pressure and the integrals $I(2)$ and $I(4)$ of all `particles`\
+        from a single evaluation of the distribution function on the Gauss-Legendre nodes of the\
+        conformal momentum $y = p a$:
+
+        \begin{equation}
+            f = \frac{e^{-\frac{E_N(y)}{a T}}}{1 + \eta e^{-\frac{E_N(y)}{a T}}}, \quad
+            E = \frac{E_N(y)}{a}, \quad p = \frac{y}{a}
+        \end{equation}
+
+        Particles are evaluated together as rows of a single array. If `TABULATED` is set, the\
+        integrals are interpolated from `particles.tables` instead wherever they are tabulated.\
+        The results are stored in `particle._thermodynamics` along with the state they were\
+        computed for.
+
+        :param aT: Temperature to evaluate all particles at instead of their own `particle.aT`,\
+                   e.g. the one equilibrium particles are about to be updated to
+        :param names: Integrals of `MOMENTS` to compute, e.g. only $I(2)$ and $I(4)$ of the\
+                      dust regime particles
+    """
+    particles = list(particles)
+    temperatures = [particle.aT if aT is None else aT for particle in particles]
+
+    tabulated = []
+    if TABULATED:
+        from particles import tables
+        tabulated = [i for i, particle in enumerate(particles)
+                     if particle.conformal_mass / temperatures[i] <= tables.Z_MAX]
+
+    results = [None] * len(particles)
+    for method, indices in (
+        (tabulated_moments, tabulated),
+        (quadrature_moments, [i for i in range(len(particles)) if i not in tabulated])
+    ):
+        if not indices:
+            continue
+        values = method([particles[i] for i in indices], [temperatures[i] for i in indices],
+                        names)
+        for j, i in enumerate(indices):
+            results[i] = {key: value[j] for key, value in values.items()}
+
+    for particle, temperature, result in zip(particles, temperatures, results):
+        key = (temperature, particle.params.a, particle.mass)
+        cached = getattr(particle, '_thermodynamics', None)
+        if cached is not None and cached[0] == key:
+            result.update((name, value) for name, value in cached[1].items()
+                          if name not in result)
+        particle._thermodynamics = (key, result)
+
+    return results
+
+
+def column(values):
+    return numpy.array(values, dtype=float)[:, numpy.newaxis]
+
+
+def quadrature_moments(particles, temperatures, names=MOMENTS):
+    a = column([particle.params.a for particle in particles])
+    aT = column(temperatures)
+    mass = column([particle.conformal_mass for particle in particles])
+    eta = column([particle.eta for particle in particles])
+    dof = column([particle.dof for particle in particles])
+    lower = column([particle.grid.MIN_MOMENTUM for particle in particles])
+    upper = column([particle.grid.MAX_MOMENTUM for particle in particles])
+
+    sub = (upper - lower) / 2.
+    y = sub * integrators.points + (upper + lower) / 2.
+    E_N = numpy.sqrt(y**2 + mass**2)
+
+    exponent = numpy.exp(-E_N / aT)
+
+    def integrate(values):
+        return dof[:, 0] / 2. / numpy.pi**2 * sub[:, 0] * numpy.dot(values, integrators.weights)
+
+    values = {}
+    if set(names) & {'density', 'energy_density', 'pressure'}:
+        f = exponent / (1. + eta * exponent)
+        values.update({
+            'density': integrate(f * y**2) / a[:, 0]**3,
+            'energy_density': integrate(f * y**2 * E_N) / a[:, 0]**4,
+            'pressure': integrate(f * y**4 / E_N) / 3. / a[:, 0]**4
+        })
+    if set(names) & {'I2', 'I4'}:
+        df = exponent / (exponent + eta)**2
+        values.update({
+            'I2': integrate(df * y**2),
+            'I4': integrate(df * y**4)
+        })
+
+    return {name: values[name] for name in names}
+
+
+def tabulated_moments(particles, temperatures, names=MOMENTS):
+    """ Tabulated integrals $J(z)$ scaled with the powers of temperature:
+
+        \begin{equation}
+            n = \frac{g}{2 \pi^2} T^3 J_n, \quad \rho = \frac{g}{2 \pi^2} T^4 J_\rho, \quad
+            P = \frac{g}{2 \pi^2} T^4 J_P, \quad I(k) = \frac{g}{2 \pi^2} (a T)^{k+1} J_{I(k)}
+        \end{equation}
+    """
+    from particles import tables
+
+    aT = numpy.array(temperatures, dtype=float)
+    a = numpy.array([particle.params.a for particle in particles])
+    z = numpy.array([particle.conformal_mass for particle in particles]) / aT
+    eta = numpy.array([particle.eta for particle in particles])
+    factor = numpy.array([particle.dof for particle in particles]) / 2. / numpy.pi**2
+
+    J = {name: numpy.empty(len(particles)) for name in tables.FUNCTIONS}
+    for sign in set(eta):
+        selected = eta == sign
+        for name, value in tables.table(sign)(z[selected]).items():
+            J[name][selected] = value
+
+    T = aT / a
+    values = {
+        'density': factor * T**3 * J['density'],
+        'energy_density': factor * T**4 * J['energy_density'],
+        'pressure': factor * T**4 * J['pressure'],
+        'I2': factor * aT**3 * J['I2'],
+        'I4': factor * aT**5 * J['I4']
+    }
+    return {name: values[name] for name in names}
@@ -3,19 +3,22 @@
 """
 from __future__ import division
 import numpy
-from common import linear_interpolation
+from common import GRID, integrators
 from common.integrators import lambda_integrate
 
 
 name = 'non-equilibrium'
 
+""" Integrands below are evaluated at all quadrature nodes at once: the distribution function\
+    is interpolated from the grid with `distribution_array` """
+
 
 @lambda_integrate()
 def density(particle):
-    return numpy.vectorize(lambda y: (
-        particle.distribution(y) * y**2
+    return lambda y: (
+        particle.distribution_array(y) * y**2
         * particle.dof / 2. / numpy.pi**2 / particle.params.a**3
-    ), otypes=[numpy.float_])
+    )
 
 
 @lambda_integrate()
@@ -27,11 +30,11 @@ def energy_density(particle):
             \frac{M_N^2 x^2}{m^2}} f(y)
         \end{equation}
     """
-    return numpy.vectorize(lambda y: (
-        particle.distribution(y)
+    return lambda y: (
+        particle.distribution_array(y)
         * y**2 * particle.conformal_energy(y)
         * particle.dof / 2. / numpy.pi**2 / particle.params.a**4
-    ), otypes=[numpy.float_])
+    )
 
 
 @lambda_integrate()
@@ -43,11 +46,11 @@ def pressure(particle):
             { \sqrt{y^2 + \frac{M_N^2 x^2}{m^2}} }
         \end{equation}
     """
-    return numpy.vectorize(lambda p: (
-        particle.distribution(p) * p ** 4
+    return lambda p: (
+        particle.distribution_array(p) * p ** 4
         / particle.conformal_energy(p)
         * particle.dof / 6. / numpy.pi**2 / particle.params.a**4
-    ), otypes=[numpy.float_])
+    )
 
 
 """ ## Master equation terms """
@@ -60,15 +63,17 @@ def pressure(particle):
 """
 
 
-@lambda_integrate()
 def numerator(particle):
-    integral = linear_interpolation(particle.collision_integral / particle.params.x,
-                                    particle.grid.TEMPLATE)
-    return numpy.vectorize(lambda y: (
-        -1. * particle.dof / 2. / numpy.pi**2
-        * y**2 * particle.conformal_energy(y)
-        * integral(y)
-    ), otypes=[numpy.float_])
+    """ Collision integral is known on the grid, so it is integrated with the quadrature weights\
+        that include its linear interpolation to the nodes """
+    quadrature = integrators.quadrature(GRID.BOUNDS)
+    y = quadrature.nodes
+
+    weights = quadrature.grid_weights(particle.grid.TEMPLATE,
+                                      factor=y**2 * particle.conformal_energy(y))
+
+    return (-1. * particle.dof / 2. / numpy.pi**2
+            * numpy.dot(weights, particle.collision_integral / particle.params.x))
 
 
 def denominator(particle):
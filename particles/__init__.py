@@ -8,13 +8,15 @@ regimes
 from __future__ import division
 
 import numpy
+import warnings
 
 from common import GRID, UNITS, statistics as STATISTICS
-from common.integrators import adams_moulton_solver
-from common.utils import PicklableObject, trace_unhandled_exceptions
+from common.integrators import adams_moulton_solver, adams_bashforth_correction, \
+    linearly_implicit_adams_moulton_solver, MultistepHistory
+from common.utils import PicklableObject, trace_unhandled_exceptions, getenv, getboolenv
 
 from particles import DustParticle, RadiationParticle, IntermediateParticle, NonEqParticle
-from KAWANO.interpolation import dist_interp_values as distribution_interpolation
+from particles.interpolation import distribution_interpolation, distribution_interpolation_weights
 
 
 class REGIMES(dict):
@@ -50,6 +52,19 @@ class AbstractParticle(PicklableObject):
         'grid': GRID
     }
 
+    # Number of the last collision integrals kept for the multistep solver
+    SOLVER_HISTORY = 4
+    # Distribution function snapshots are kept every `snapshot_freq` steps, none if `0`. Unless\
+    # they are streamed to `snapshot_file`, the memory taken by the snapshots grows by one\
+    # distribution function every `snapshot_freq` steps: long calculations should use a larger\
+    # `SNAPSHOT_FREQ` or `STREAM_SNAPSHOTS`
+    snapshot_freq = int(getenv('SNAPSHOT_FREQ', 1))
+    # `utils.HistoryFile` that receives the snapshots instead of `data['distribution']`
+    snapshot_file = None
+    # Collision integrals are solved with their full Jacobian over the distribution function,\
+    # see `DistributionParticle.solve_collision_integral`
+    implicit_collisions = getboolenv('IMPLICIT_COLLISIONS')
+
     def __init__(self, **kwargs):
 
         settings = dict(self._defaults)
@@ -63,9 +78,10 @@ class AbstractParticle(PicklableObject):
         self.set_grid(self.grid)
 
         self.collision_integrals = []
+        self.steps = 0
         self.data = {
             'distribution': [self._distribution],
-            'collision_integral': [],
+            'collision_integral': MultistepHistory(self.SOLVER_HISTORY),
             'density': [],
             'energy_density': []
         }
@@ -170,13 +186,16 @@ class DistributionParticle(AbstractParticle):
         'name', 'symbol',
         'mass', 'decoupling_temperature',
         'dof', 'eta', 'equilibrium_distribution_function',
-        'data',
+        'data', 'steps',
         '_distribution',
-        'collision_integral', 'collision_integrals',
+        'collision_integral', 'collision_integrals', 'step_error',
         'T', 'aT', 'params',
         'grid'
     ]
 
+    # Relative local error estimate of the last collision integral step
+    step_error = 0.
+
     def set_params(self, params):
         """ Set internal parameters using arguments or default values """
         self.params = params
@@ -230,112 +249,152 @@ class DistributionParticle(AbstractParticle):
 
         # Clear collision integrands for the next computation step
         self.collision_integrals = []
-        self.data['collision_integral'].append(self.collision_integral)
-        self.data['distribution'].append(self._distribution)
+        self.data['collision_integral'].append(self.collision_integral, self.params.dy)
+
+        self.steps += 1
+        if self.snapshot_freq and self.steps % self.snapshot_freq == 0:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        """ Save the distribution function for the analysis """
+        if self.snapshot_file:
+            self.snapshot_file.append(self._distribution)
+        else:
+            self.data['distribution'].append(self._distribution)
 
     def integrate_collisions(self):
-        return numpy.vectorize(self.calculate_collision_integral,
-                               otypes=[numpy.float_])(self.grid.TEMPLATE)
+        return self.calculate_collision_integral(self.grid.TEMPLATE)
 
     @trace_unhandled_exceptions
     def calculate_collision_integral(self, p0):
-        """ ### Particle collisions integration """
+        """ ### Particle collisions integration
+
+            `p0` can be either a single momentum or an array of momenta: collision integrals of\
+            all of them are then computed at once. """
+
+        p0 = numpy.asarray(p0, dtype=numpy.float_)
 
         if not self.collision_integrals:
-            return 0
+            return numpy.zeros_like(p0)
 
         As = []
         Bs = []
 
         for integral in self.collision_integrals:
-            As.append(integral.integrate(p0, integral.F_1))
-            Bs.append(integral.integrate(p0, integral.F_f))
-
-        order = min(len(self.data['collision_integral']) + 1, 5)
+            A, B = integral.linearized(p0)
+            As.append(A)
+            Bs.append(B)
+
+        return self.solve_collision_integral(p0, sum(As), sum(Bs))
+
+    def solve_collision_integral(self, p0, A, B):
+        """ Collision integral of the momenta `p0` given the constant `A` and the variable `B`\
+            parts of the linearized collision integrals summed over all collision integrals.
+
+            The distribution function change is found by the implicit Adams-Moulton method.\
+            Only the dependence of the collision integral on $f_1$ through the `B` term is treated\
+            implicitly by default. Right after the decoupling the collisions are fast compared\
+            to the expansion, and the coupling of the momenta through the other particles of the\
+            same species becomes stiff as well. With `implicit_collisions` the collision\
+            integrals of the whole grid are linearized with their full `jacobian` over the\
+            distribution function of the particle, while the other species are still taken\
+            from the previous step. This needs the collision integrals of the whole grid at once:\
+            the momenta computed separately (e.g. by the pool workers without the shared state)\
+            fall back to the diagonal solver with a warning. """
+
+        p0 = numpy.asarray(p0, dtype=numpy.float_)
+        A = numpy.asarray(A)
+        B = numpy.asarray(B)
+
+        fs = self.data['collision_integral']
+        order = min(len(fs) + 1, 5)
 
         index = numpy.searchsorted(self.grid.TEMPLATE, p0)
-        fs = [i[index] for i in self.data['collision_integral'][-order+1:]]
 
         H = self.params.H
 
-        if p0 == 0:
-            A = sum(As)
-            B = sum(Bs)
-            feq = self.equilibrium_distribution(p0)
+        resting = p0 == 0
+        if resting.any():
+            A_0 = A[resting][0]
+            B_0 = B[resting][0]
+            feq = self.equilibrium_distribution(0.)
             print "{} p0 = {:.3e} A = {:.3e} t = {:.3e} d = {:.3e}".format(
-                self.symbol, p0 / UNITS.MeV, A * UNITS.s, -1. / B / UNITS.s, -(A/B) / feq
+                self.symbol, 0., A_0 * UNITS.s, -1. / B_0 / UNITS.s, -(A_0/B_0) / feq
             )
 
-        prediction = adams_moulton_solver(y=self.distribution(p0), fs=fs,
-                                          A=sum(As) / H, B=sum(Bs) / H,
-                                          h=self.params.dy, order=order)
+        distribution = self.distribution_array(p0)
 
-        total_integral = (prediction - self.distribution(p0)) / self.params.dy
+        implicit = self.implicit_collisions and numpy.array_equal(p0, self.grid.TEMPLATE)
+        if self.implicit_collisions and not implicit:
+            warnings.warn("Implicit collisions of {} need the whole grid at once, the diagonal"
+                          " solver is used instead".format(self.symbol), RuntimeWarning)
 
-        return total_integral
+        if implicit:
+            J = sum(integral.jacobian(p0) for integral in self.collision_integrals)
+            prediction = linearly_implicit_adams_moulton_solver(y=distribution, fs=fs,
+                                                                f=(A + B * distribution) / H,
+                                                                J=J / H,
+                                                                h=self.params.dy, order=order)
+        else:
+            prediction = adams_moulton_solver(y=distribution, fs=fs,
+                                              A=A / H, B=B / H,
+                                              h=self.params.dy, order=order, index=index)
+
+        """ Local error estimate of the step: difference of the corrector and the explicit\
+            Adams-Bashforth predictor on the same history """
+        if len(fs):
+            predictor = distribution + adams_bashforth_correction(fs=fs, h=self.params.dy,
+                                                                  order=order - 1, index=index)
+            self.step_error = (numpy.max(numpy.abs(prediction - predictor))
+                               / max(numpy.max(numpy.abs(prediction)), numpy.finfo(float).tiny))
+        else:
+            self.step_error = 0.
 
-    def distribution(self, p):
-        """
-        ## Distribution function interpolation
+        total_integral = (prediction - distribution) / self.params.dy
 
-        Two possible strategies for the distribution function interpolation are implemented:
+        return total_integral
 
-          * linear interpolation
-          * exponential interpolation
+    def distribution(self, p):
+        """ Distribution function of the particle at a single momentum `p` """
+        return self.distribution_array(p)[()]
 
-        While linear interpolation is exceptionally simple, the exponential interpolation gives\
-        exact results for the equilibrium functions - thus collision integral for them almost\
-        exactly cancels out unlike the case of linear interpolation.
+    def distribution_array(self, p):
+        """ Distribution function of the particle mapped over an array of momenta `p` at once.
 
-        Distribution functions are continuously evaluated each during the simulation, so to avoid\
-        excessive evaluation of the costly logarithms and exponentials, this function first checks\
-        if the current momenta value coincides with any of the grid points.
-        """
+            Momenta beyond the grid and all momenta of the particles in equilibrium are given by\
+            the equilibrium distribution function, the rest are interpolated over the grid with\
+            `particles.interpolation.distribution_interpolation`. """
+        p = numpy.absolute(numpy.asarray(p, dtype=numpy.float_))
 
-        p = abs(p)
-        if self.in_equilibrium or p > self.grid.MAX_MOMENTUM:
+        if self.in_equilibrium:
             return self.equilibrium_distribution(p)
 
-        return distribution_interpolation(
-            p,
-            self.grid.TEMPLATE,
-            self._distribution
-        )
-
-        index = numpy.searchsorted(self.grid.TEMPLATE, p)
+        values = numpy.empty(p.shape)
 
-        if index >= self.grid.MOMENTUM_SAMPLES - 1:
-            return self._distribution[-1]
+        outside = p > self.grid.MAX_MOMENTUM
+        if outside.any():
+            values[outside] = self.equilibrium_distribution(p[outside])
 
-        if p == self.grid.TEMPLATE[index]:
-            return self._distribution[index]
+        inside = ~outside
+        values[inside] = distribution_interpolation(self.grid.TEMPLATE, self._distribution,
+                                                    p[inside], mass=self.conformal_mass,
+                                                    eta=self.eta)
 
-        # Determine the closest grid points
+        return values
 
-        i_low = index
-        p_low = self.grid.TEMPLATE[i_low]
+    def distribution_derivatives(self, p):
+        """ Derivatives of `distribution_array` at the momenta `p` over the distribution function\
+            on the grid: indices of the lower grid points of the intervals of `p` and the\
+            derivatives over the values at the lower and the upper grid points. Distribution\
+            function does not depend on the grid beyond it and in the equilibrium. """
+        p = numpy.absolute(numpy.asarray(p, dtype=numpy.float_))
 
-        i_high = index + 1
-        p_high = self.grid.TEMPLATE[i_high]
-
-        """ ### Exponential interpolation """
-        E_p = self.conformal_energy(p)
-        E_low = self.conformal_energy(p_low)
-        E_high = self.conformal_energy(p_high)
-
-        """
-        \begin{equation}
-            g = \frac{ (E_p - E_{low}) g_{high} + (E_{high} - E_p) g_{low} }\
-            { (E_{high} - E_{low}) }
-        \end{equation}
-        """
-
-        g_high = numpy.log(1 / self._distribution[i_high] - 1)
-        g_low = numpy.log(1 / self._distribution[i_low] - 1)
-
-        g = ((E_p - E_low) * g_high + (E_high - E_p) * g_low) / (E_high - E_low)
+        index, low, high = distribution_interpolation_weights(
+            self.grid.TEMPLATE, self._distribution, p, mass=self.conformal_mass, eta=self.eta
+        )
 
-        return 1. / (numpy.exp(g) + self.eta)
+        independent = (p > self.grid.MAX_MOMENTUM) | self.in_equilibrium
+        return index, numpy.where(independent, 0., low), numpy.where(independent, 0., high)
 
     def equilibrium_distribution(self, y=None, aT=None):
 
@@ -367,7 +426,7 @@ class DensityParticle(AbstractParticle):
         'mass', 'decoupling_temperature',
         'dof', 'eta', 'equilibrium_distribution_function',
         'data',
-        '_density'
+        '_density',
         'collision_integral', 'collision_integrals',
         'T', 'aT', 'params',
         'mu'
@@ -398,7 +457,7 @@ class DensityParticle(AbstractParticle):
 
         self.collision_integrals = []
         self.data = {
-            'collision_integral': [],
+            'collision_integral': MultistepHistory(self.SOLVER_HISTORY),
             'density': [],
             'energy_density': []
         }
@@ -459,7 +518,7 @@ class DensityParticle(AbstractParticle):
 
         # Clear collision integrands for the next computation step
         self.collision_integrals = []
-        self.data['collision_integral'].append(self.collision_integral)
+        self.data['collision_integral'].append(self.collision_integral, self.params.dy)
         self.data['density'].append(self._density)
 
     def compute_chemical_potential(self):
@@ -484,9 +543,8 @@ class DensityParticle(AbstractParticle):
             As.append(integral.integrate(integral.F_1))
             Bs.append(integral.integrate(integral.F_f))
 
-        order = min(len(self.data['collision_integral']) + 1, 5)
-
-        fs = self.data['collision_integral'][-order+1:]
+        fs = self.data['collision_integral']
+        order = min(len(fs) + 1, 5)
 
         H = self.params.H
 
@@ -0,0 +1,14 @@
+"""
+# Distribution function interpolation
+
+Compiled Cython extension is used when it is built (see `setup.py`), otherwise the pure NumPy\
+implementation with the same interface is imported. Derivatives of the interpolation over the\
+grid values are only implemented in NumPy.
+"""
+
+try:
+    from particles.interpolation.interpolation import distribution_interpolation
+except ImportError:
+    from particles.interpolation.numpy_interpolation import distribution_interpolation
+
+from particles.interpolation.numpy_interpolation import distribution_interpolation_weights
@@ -1,97 +1,88 @@
-""" Cython version of the distribution interpolation.
+# cython: language_level=2
+""" Compiled version of the distribution function interpolation.
 
-    TODO: currently massless only
-    TODO: no significant performance gain """
+    Mirrors `numpy_interpolation.distribution_interpolation`, see it for the details of the\
+    algorithm. To build the extension, run `python setup.py build_ext --inplace` in this folder. """
 
-from __future__ import division
-import math
 import numpy
 cimport numpy
 cimport cython
+from libc.math cimport exp, log, sqrt, fabs
 
-# We now need to fix a datatype for our arrays. I've used the variable
-# DTYPE for this, which is assigned to the usual NumPy runtime
-# type info object.
 DTYPE = numpy.float_
-# "ctypedef" assigns a corresponding compile-time type to DTYPE_t. For
-# every type in the numpy module there's a corresponding compile-time
-# type with a _t-suffix.
 ctypedef numpy.float_t DTYPE_t
 
-cdef int exponential_interpolation = True
 
-cdef DTYPE_t energy(DTYPE_t p, DTYPE_t m):
-    return numpy.sqrt(p**2 + m**2)
+cdef inline bint finite(DTYPE_t x):
+    return x - x == 0
 
 
-@cython.boundscheck(False)  # turn of bounds-checking for entire function
-@cython.wraparound(False)
-@cython.cdivision(True)
-def distribution_interpolation(numpy.ndarray[DTYPE_t, ndim=1] grid,
-                               numpy.ndarray[DTYPE_t, ndim=1] distribution,
-                               DTYPE_t p,
-                               DTYPE_t m,
-                               int eta=1,
-                               DTYPE_t MIN_MOMENTUM=0., DTYPE_t MOMENTUM_STEP=0.):
-
-    cdef DTYPE_t p_low = -1, p_high = -1, remnant
-
-    cdef unsigned int i = 0, i_low, i_high
-
-    remnant = (p - MIN_MOMENTUM) % MOMENTUM_STEP
-    index = int((p - MIN_MOMENTUM) / MOMENTUM_STEP - remnant)
-
-    if remnant == 0:
-        return distribution[index]
-
-    if index < 0:
-        return distribution[0]
-
-    if index >= len(grid) - 1:
-        return distribution[len(grid) - 1]
-
-    # Determine the closest grid points
-
-    i_low = index
-    p_low = grid[i_low]
+cdef inline DTYPE_t energy(DTYPE_t p, DTYPE_t mass):
+    if mass > 0:
+        return sqrt(p * p + mass * mass)
+    return fabs(p)
 
-    i_high = index + 1
-    p_high = grid[i_high]
 
-    cdef DTYPE_t E_p, E_low, E_high, g_high, g_low, g
-
-    if exponential_interpolation:
-        """ === Exponential interpolation === """
-        E_p = energy(p, m)
-        E_low = energy(p_low, m)
-        E_high = energy(p_high, m)
-
-        """
-        \begin{equation}
-            g = \frac{ (E_p - E_{low}) g_{high} + (E_{high} - E_p) g_{low} }\
-            { (E_{high} - E_{low}) }
-        \end{equation}
-        """
-
-        g_high = distribution[i_high]
-        g_low = distribution[i_low]
-
-        if g_high > 0:
-            g_high = (1. / g_high - 1.)
-            if g_high > 0:
-                g_high = math.log(g_high)
-
-        if g_low > 0:
-            g_low = (1. / g_low - 1.)
-            if g_low > 0:
-                g_low = math.log(g_low)
-
-        g = ((E_p - E_low) * g_high + (E_high - E_p) * g_low) / (E_high - E_low)
-
-        return 1. / (numpy.exp(g) + eta)
-
-    else:
-        """ === Linear interpolation === """
-        return (
-            distribution[i_low] * (p_high - p) + distribution[i_high] * (p - p_low)
-        ) / (p_high - p_low)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void interpolate(DTYPE_t[:] grid, DTYPE_t[:] distribution, DTYPE_t[:] p, DTYPE_t[:] values,
+                      DTYPE_t mass, DTYPE_t eta, bint exponential):
+
+    cdef Py_ssize_t n = grid.shape[0], i, k, low, high, middle
+    cdef DTYPE_t x, p_low, p_high, f_low, f_high, E_p, E_low, E_high, g, value
+
+    for k in range(p.shape[0]):
+        x = p[k]
+
+        # Index of the last grid point not greater than `x` within the grid intervals
+        low = 0
+        high = n
+        while low < high:
+            middle = (low + high) // 2
+            if grid[middle] <= x:
+                low = middle + 1
+            else:
+                high = middle
+        i = min(max(low - 1, 0), n - 2)
+
+        p_low = grid[i]
+        p_high = grid[i + 1]
+        f_low = distribution[i]
+        f_high = distribution[i + 1]
+
+        if x == p_low:
+            values[k] = f_low
+            continue
+        if x == p_high:
+            values[k] = f_high
+            continue
+
+        if exponential:
+            E_p = energy(x, mass)
+            E_low = energy(p_low, mass)
+            E_high = energy(p_high, mass)
+
+            g = (
+                (E_p - E_low) * log(1. / f_high - eta) + (E_high - E_p) * log(1. / f_low - eta)
+            ) / (E_high - E_low)
+            value = 1. / (exp(g) + eta)
+
+            if finite(g) and finite(value):
+                values[k] = value
+                continue
+
+        values[k] = (f_low * (p_high - x) + f_high * (x - p_low)) / (p_high - p_low)
+
+
+def distribution_interpolation(grid, distribution, p, mass=0., eta=1., exponential=True):
+    """ Interpolate the `distribution` given on the `grid` at the array of momenta `p` """
+    p = numpy.asarray(p, dtype=DTYPE)
+    values = numpy.empty(p.shape, dtype=DTYPE)
+
+    interpolate(numpy.ascontiguousarray(grid, dtype=DTYPE),
+                numpy.ascontiguousarray(distribution, dtype=DTYPE),
+                numpy.ascontiguousarray(p).reshape(-1), values.reshape(-1),
+                mass, eta, exponential)
+
+    return values
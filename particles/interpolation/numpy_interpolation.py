@@ -0,0 +1,132 @@
+""" Pure NumPy version of the distribution function interpolation.
+
+    Used when the compiled extension `interpolation.pyx` is not built. Both implementations share\
+    the signature and the algorithm. """
+
+import numpy
+
+
+def distribution_interpolation(grid, distribution, p, mass=0., eta=1., exponential=True):
+    """
+    ## Distribution function interpolation
+
+    Two possible strategies for the distribution function interpolation are implemented:
+
+      * linear interpolation
+      * exponential interpolation
+
+    While linear interpolation is exceptionally simple, the exponential interpolation gives\
+    exact results for the equilibrium functions - thus collision integral for them almost\
+    exactly cancels out unlike the case of linear interpolation.
+
+    The exponential interpolation is linear in the conformal energy for the function
+
+    \begin{equation}
+        g = \ln \left( \frac{1}{f} - \eta \right)
+    \end{equation}
+
+    \begin{equation}
+        g = \frac{ (E_p - E_{low}) g_{high} + (E_{high} - E_p) g_{low} }\
+        { (E_{high} - E_{low}) }
+    \end{equation}
+
+    Points where $g$ is undefined fall back to the linear interpolation. Momenta that\
+    coincide with the grid points take the grid values exactly, momenta outside of the grid are\
+    extrapolated from the closest grid interval.
+
+    :param grid: Increasing array of the grid momenta
+    :param distribution: Distribution function values on the `grid`
+    :param p: Array of momenta to interpolate at
+    :param mass: Conformal mass of the particle
+    :param eta: $\eta$ of the particle statistics: `1` for fermions, `-1` for bosons
+    :param exponential: Use exponential interpolation, linear otherwise
+    """
+    p = numpy.asarray(p, dtype=numpy.float_)
+    index = numpy.clip(numpy.searchsorted(grid, p, side='right') - 1, 0, len(grid) - 2)
+
+    p_low = grid[index]
+    p_high = grid[index + 1]
+    f_low = distribution[index]
+    f_high = distribution[index + 1]
+
+    values = (f_low * (p_high - p) + f_high * (p - p_low)) / (p_high - p_low)
+
+    if exponential:
+        if mass > 0:
+            E_p = numpy.sqrt(p**2 + mass**2)
+            E_low = numpy.sqrt(p_low**2 + mass**2)
+            E_high = numpy.sqrt(p_high**2 + mass**2)
+        else:
+            E_p = numpy.absolute(p)
+            E_low = numpy.absolute(p_low)
+            E_high = numpy.absolute(p_high)
+
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            g_low = numpy.log(1. / f_low - eta)
+            g_high = numpy.log(1. / f_high - eta)
+            g = ((E_p - E_low) * g_high + (E_high - E_p) * g_low) / (E_high - E_low)
+            exponential_values = 1. / (numpy.exp(g) + eta)
+
+        values = numpy.where(numpy.isfinite(g) & numpy.isfinite(exponential_values),
+                             exponential_values, values)
+
+    values = numpy.where(p == p_low, f_low, values)
+    return numpy.where(p == p_high, f_high, values)
+
+
+def distribution_interpolation_weights(grid, distribution, p, mass=0., eta=1., exponential=True):
+    """ Derivatives of `distribution_interpolation` at the momenta `p` over the values of the\
+        `distribution` at the two grid points of the interval of every momentum.
+
+        For the exponential interpolation
+
+        \begin{equation}
+            \frac{\partial f}{\partial f_{low}} = \frac{E_{high} - E_p}{E_{high} - E_{low}}\
+            \frac{f (1 - \eta f)}{f_{low} (1 - \eta f_{low})}
+        \end{equation}
+
+        and similarly for $f_{high}$.
+
+        :returns: indices of the lower grid points and the derivatives over the values at the\
+                  lower and the upper grid points
+    """
+    p = numpy.asarray(p, dtype=numpy.float_)
+    index = numpy.clip(numpy.searchsorted(grid, p, side='right') - 1, 0, len(grid) - 2)
+
+    p_low = grid[index]
+    p_high = grid[index + 1]
+
+    high = (p - p_low) / (p_high - p_low)
+    low = 1. - high
+
+    if exponential:
+        f_low = distribution[index]
+        f_high = distribution[index + 1]
+
+        if mass > 0:
+            E_p = numpy.sqrt(p**2 + mass**2)
+            E_low = numpy.sqrt(p_low**2 + mass**2)
+            E_high = numpy.sqrt(p_high**2 + mass**2)
+        else:
+            E_p = numpy.absolute(p)
+            E_low = numpy.absolute(p_low)
+            E_high = numpy.absolute(p_high)
+
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            t = (E_p - E_low) / (E_high - E_low)
+            g = t * numpy.log(1. / f_high - eta) + (1. - t) * numpy.log(1. / f_low - eta)
+            values = 1. / (numpy.exp(g) + eta)
+            factor = values * (1. - eta * values)
+            exponential_low = (1. - t) * factor / (f_low * (1. - eta * f_low))
+            exponential_high = t * factor / (f_high * (1. - eta * f_high))
+
+        finite = numpy.isfinite(g) & numpy.isfinite(values)
+        low = numpy.where(finite, exponential_low, low)
+        high = numpy.where(finite, exponential_high, high)
+
+    at_low = p == p_low
+    at_high = p == p_high
+    low = numpy.where(at_low, 1., numpy.where(at_high, 0., low))
+    high = numpy.where(at_low, 0., numpy.where(at_high, 1., high))
+
+    return index, low, high
@@ -0,0 +1,141 @@
+"""
+# Tabulated equilibrium thermodynamics
+
+Thermodynamic integrals of the equilibrium species depend on the temperature only through the\
+scaling with powers of $T$ and the ratio $z = M / T$. For a given statistics (sign $\eta$)\
+the dimensionless integrals
+
+\begin{align}
+    J_n(z) &= \int_0^\infty du \, u^2 f(\epsilon), \quad
+    J_\rho(z) = \int_0^\infty du \, u^2 \epsilon f(\epsilon), \quad
+    J_P(z) = \frac13 \int_0^\infty du \, \frac{u^4}{\epsilon} f(\epsilon) \\\\
+    J_{I(k)}(z) &= \int_0^\infty du \, u^k \frac{e^{-\epsilon}}{\left(e^{-\epsilon} + \eta\right)^2}
+\end{align}
+
+with $\epsilon = \sqrt{u^2 + z^2}$ are tabulated once on a grid of $z$ and then\
+interpolated with cubic splines of $\log J(z)$.
+
+Tables are built lazily for each statistics and saved to the `THERMODYNAMICS_TABLES_DIR` folder\
+(`particles/tables` by default) to be reused by later runs.
+
+### Accuracy
+
+Against the adaptive quadrature `scipy.integrate.quad` of the same integrals, the interpolated\
+values have relative error below $2 \cdot 10^{-9}$ for $z \le$ `Z_MAX`.
+
+The Gauss-Legendre quadrature over the momentum grid used by `particles.IntermediateParticle` by\
+default truncates the integrals at `MAX_MOMENTUM`. With $a T = $ `MAX_MOMENTUM` / 20 the two\
+differ by about $10^{-6}$ for the density and $2 \cdot 10^{-5}$ for $I(4)$ at $z \lesssim 2$,\
+$10^{-4}$ at $z = 10$ and $10^{-2}$ at $z = 20$, mostly due to the truncated tail that the tables\
+include. For $z >$ `Z_MAX` the contribution of the species is suppressed by $e^{-z}$ and the\
+quadrature is used.
+"""
+
+import os
+import numpy
+
+from common import utils
+
+
+FOLDER = utils.getenv('THERMODYNAMICS_TABLES_DIR', os.path.join(os.path.dirname(__file__),
+                                                                'tables'))
+
+# Tabulated range and step of $z = M / T$
+Z_MAX = 100.
+Z_STEP = 0.02
+Z_REFINED = 120
+
+
+def grid():
+    """ Nodes of the tables: uniform with the step `Z_STEP`, refined geometrically towards\
+        $z = 0$ where the Bose-Einstein integrals are not analytic in $z$ """
+    return numpy.union1d(numpy.logspace(-6, 0, Z_REFINED, endpoint=False),
+                         numpy.linspace(0, Z_MAX, int(round(Z_MAX / Z_STEP)) + 1))
+
+
+FUNCTIONS = ('density', 'energy_density', 'pressure', 'I2', 'I4')
+
+# Composite Gauss-Legendre rule for the integrals over $u \in [0, U_{MAX}]$. Panels are\
+# refined geometrically towards $u = 0$ where the Bose-Einstein integrands vary on the scale of $z$
+U_MAX = 150.
+U_PANELS = 600
+U_REFINED = 40
+U_ORDER = 8
+
+
+def integrals(z, eta):
+    """ Dimensionless integrals $J(z)$ of `FUNCTIONS` for the array of `z` """
+    points, weights = numpy.polynomial.legendre.leggauss(U_ORDER)
+    edges = numpy.concatenate([[0.], numpy.logspace(-8, 0, U_REFINED, endpoint=False),
+                               numpy.linspace(1., U_MAX, U_PANELS + 1)])
+    half = numpy.diff(edges) / 2.
+    u = (half[:, numpy.newaxis] * points + (edges[:-1] + half)[:, numpy.newaxis]).ravel()
+    w = (half[:, numpy.newaxis] * weights).ravel()
+
+    z = numpy.asarray(z, dtype=float)[:, numpy.newaxis]
+    epsilon = numpy.sqrt(u**2 + z**2)
+    exponent = numpy.exp(-epsilon)
+    f = exponent / (1. + eta * exponent)
+    df = exponent / (exponent + eta)**2
+
+    return numpy.array([
+        numpy.dot(f * u**2, w),
+        numpy.dot(f * u**2 * epsilon, w),
+        numpy.dot(f * u**4 / epsilon, w) / 3.,
+        numpy.dot(df * u**2, w),
+        numpy.dot(df * u**4, w)
+    ])
+
+
+class ThermodynamicTable(object):
+
+    """ Interpolation tables of `FUNCTIONS` for the statistics with the sign `eta` """
+
+    def __init__(self, eta):
+        from scipy.interpolate import CubicSpline
+
+        self.eta = eta
+        self.path = os.path.join(FOLDER, 'thermodynamics_{}.npz'.format(
+            'fermion' if eta > 0 else 'boson'))
+
+        z = grid()
+        values = self.load(z)
+        if values is None:
+            values = numpy.concatenate([integrals(chunk, eta)
+                                        for chunk in numpy.array_split(z, len(z) // 200 + 1)],
+                                       axis=1)
+            self.save(z, values)
+
+        self.splines = {name: CubicSpline(z, numpy.log(values[i]))
+                        for i, name in enumerate(FUNCTIONS)}
+
+    def load(self, z):
+        if not os.path.exists(self.path):
+            return None
+
+        table = numpy.load(self.path)
+        if table['z'].shape != z.shape or not numpy.allclose(table['z'], z):
+            return None
+        return table['values']
+
+    def save(self, z, values):
+        utils.ensure_dir(FOLDER)
+        # Other processes may read the table while it is written
+        path = self.path + '.{}.tmp'.format(os.getpid())
+        with open(path, 'wb') as f:
+            numpy.savez(f, z=z, values=values)
+        os.rename(path, self.path)
+
+    def __call__(self, z):
+        """ Dictionary of the interpolated integrals at `z` """
+        return {name: numpy.exp(spline(z)) for name, spline in self.splines.items()}
+
+
+tables = {}
+
+
+def table(eta):
+    """ Table of the statistics with the sign `eta`, built or loaded on the first use """
+    if eta not in tables:
+        tables[eta] = ThermodynamicTable(eta)
+    return tables[eta]
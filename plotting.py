@@ -5,16 +5,15 @@ import time
 import itertools
 
 import numpy
-import pandas
 import matplotlib.pyplot as plt
 
 from common import UNITS, GRID, statistics as STATISTICS
-from common.utils import ring_deque, getboolenv
+from common.utils import ring_deque, getboolenv, read_history
 
 
 def monitor_datafile(datafolder, timer=1):
 
-    datafile = os.path.join(datafolder, 'evolution.pickle')
+    datafile = os.path.join(datafolder, 'evolution.history')
 
     def plot_backlog(data, last_datalen):
         i = last_datalen + 1
@@ -28,7 +27,7 @@ def monitor_datafile(datafolder, timer=1):
 
     plt.ion()
     plotting = Plotting()
-    data = pandas.read_pickle(datafile)
+    data = read_history(datafile)
     last_datalen = plot_backlog(data, 0)
 
     last_mtime = os.stat(datafile).st_mtime
@@ -36,7 +35,7 @@ def monitor_datafile(datafolder, timer=1):
         mtime = os.stat(datafile).st_mtime
         if mtime > last_mtime:
             try:
-                data = pandas.read_pickle(datafile)
+                data = read_history(datafile)
                 if len(data) < last_datalen:
                     print "Datafile is shorter than before, clearing the output"
                     plt.close('all')
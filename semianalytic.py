@@ -7,9 +7,8 @@ T_BBN = 0.065 * UNITS.MeV
 def step_monitor(universe):
     from copy import deepcopy
 
-    if not hasattr(universe, 'neutron_decoupling_parameters') and len(universe.kawano_data):
-        datarow = universe.kawano_data.tail(1)
-        rates = datarow.values[0][-6:]
+    if not hasattr(universe, 'neutron_decoupling_parameters') and len(universe.kawano_history):
+        rates = universe.kawano_history.last()[-6:]
         neutron_equilibration = (sum(rates[0::2]) / sum(rates[1::2]))
         if neutron_equilibration > 10 or neutron_equilibration < 0.1:
             universe.neutron_decoupling_parameters = deepcopy(universe.params)
@@ -25,35 +25,82 @@ def grid_iterator(dimension=4, grid=GRID):
         yield value, map(lambda i: grid.TEMPLATE[i], value)
 
 
-grid_json = json.dumps(GRID.TEMPLATE.tolist())
-with open(os.path.join(cwd, 'grid.json'), 'w') as f:
-    f.write(grid_json)
+def sample_momenta(dimension=4, count=20000, grid=GRID):
+    """ Random momenta combinations: half of them are taken from the grid points to hit the exact\
+        boundaries of the kinematic cases, the rest are uniformly distributed """
+    random = numpy.random.RandomState(0)
+    on_grid = grid.TEMPLATE[random.randint(0, grid.MOMENTUM_SAMPLES, size=(dimension, count))]
+    uniform = random.uniform(grid.MIN_MOMENTUM, grid.MAX_MOMENTUM, size=(dimension, count))
+    return numpy.concatenate([on_grid, uniform], axis=1)
 
 
-d1_table = numpy.ndarray(shape=(GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES,
-                                GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES))
+def check_bit_compatibility(scalar, array, dimension=4):
+    momenta = sample_momenta(dimension=dimension)
+    expected = numpy.vectorize(scalar, otypes=[numpy.float_])(*momenta)
+    assert all(array(*momenta) == expected), \
+        "{} is not bit-compatible with {}".format(array.__name__, scalar.__name__)
+    assert any(expected != 0), "Kinematic region is not sampled"
 
-for (i, j, k, l), momenta in grid_iterator():
-    d1_table[i, j, k, l] = ds.D1(*momenta)
 
-with open(os.path.join(cwd, 'D1.json'), 'w') as f:
-    f.write(json.dumps(d1_table.tolist()))
+def D1_array_test():
+    check_bit_compatibility(ds.D1, ds.D1_array)
 
 
-d2_table = numpy.ndarray(shape=(GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES,
-                                GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES))
+def D2_array_test():
+    check_bit_compatibility(ds.D2, ds.D2_array)
 
-for (i, j, k, l), momenta in grid_iterator():
-    d2_table[i, j, k, l] = ds.D2(*momenta)
 
-with open(os.path.join(cwd, 'D2.json'), 'w') as f:
-    f.write(json.dumps(d2_table.tolist()))
+def D3_array_test():
+    check_bit_compatibility(ds.D3, ds.D3_array)
 
-d3_table = numpy.ndarray(shape=(GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES,
-                                GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES))
 
-for (i, j, k, l), momenta in grid_iterator():
-    d3_table[i, j, k, l] = ds.D3(*momenta)
+def Db1_array_test():
+    check_bit_compatibility(ds.Db1, ds.Db1_array, dimension=3)
 
-with open(os.path.join(cwd, 'D3.json'), 'w') as f:
-    f.write(json.dumps(d3_table.tolist()))
+
+def Db2_array_test():
+    check_bit_compatibility(ds.Db2, ds.Db2_array, dimension=3)
+
+
+def D_array_broadcasting_test():
+    p1 = GRID.TEMPLATE[:, numpy.newaxis]
+    p2 = GRID.TEMPLATE[numpy.newaxis, :]
+    assert ds.D1_array(p1, p2, 1., 1.).shape == (GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES)
+    assert ds.D1_array(1., 1., 1., 1.) == ds.D1(1., 1., 1., 1.)
+
+
+def dump_tables():
+    grid_json = json.dumps(GRID.TEMPLATE.tolist())
+    with open(os.path.join(cwd, 'grid.json'), 'w') as f:
+        f.write(grid_json)
+
+    d1_table = numpy.ndarray(shape=(GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES,
+                                    GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES))
+
+    for (i, j, k, l), momenta in grid_iterator():
+        d1_table[i, j, k, l] = ds.D1(*momenta)
+
+    with open(os.path.join(cwd, 'D1.json'), 'w') as f:
+        f.write(json.dumps(d1_table.tolist()))
+
+    d2_table = numpy.ndarray(shape=(GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES,
+                                    GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES))
+
+    for (i, j, k, l), momenta in grid_iterator():
+        d2_table[i, j, k, l] = ds.D2(*momenta)
+
+    with open(os.path.join(cwd, 'D2.json'), 'w') as f:
+        f.write(json.dumps(d2_table.tolist()))
+
+    d3_table = numpy.ndarray(shape=(GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES,
+                                    GRID.MOMENTUM_SAMPLES, GRID.MOMENTUM_SAMPLES))
+
+    for (i, j, k, l), momenta in grid_iterator():
+        d3_table[i, j, k, l] = ds.D3(*momenta)
+
+    with open(os.path.join(cwd, 'D3.json'), 'w') as f:
+        f.write(json.dumps(d3_table.tolist()))
+
+
+if __name__ == '__main__':
+    dump_tables()
@@ -0,0 +1,378 @@
+import copy
+import numpy
+from scipy import integrate
+from . import non_equilibium_setup, with_setup_args, setup
+from common import UNITS
+from common.utils import LRUCache
+from particles import Particle
+from library.SM import particles as SMP, interactions as SMI
+from library.NuMSM import particles as NuP, interactions as NuI
+from interactions import four_particle
+
+
+@with_setup_args(non_equilibium_setup)
+def massless_kernel_reuse_test(params, universe):
+
+    params.update(universe.total_energy_density())
+
+    photon, neutrino_e, neutrino_mu = universe.particles
+    integral = universe.interactions[0].integrals[0]
+    assert all(item.specie.mass == 0 for item in integral.reaction)
+
+    p0 = neutrino_e.grid.TEMPLATE[::5]
+    bounds = (
+        integral.grids[0].BOUNDS,
+        (lambda p1: integral.grids[1].MIN_MOMENTUM,
+         lambda p1: numpy.minimum(p0[:, numpy.newaxis, numpy.newaxis] + p1,
+                                  integral.grids[1].MAX_MOMENTUM))
+    )
+
+    four_particle.kernels.clear()
+    cached = integral.integrate(p0, integral.F_f)
+    assert len(four_particle.kernels) == 1
+    assert integral.kernel(p0) is integral.kernel(p0)
+
+    # Explicit bounds are never cached
+    direct = integral.integrate(p0, integral.F_f, bounds=bounds)
+    assert len(four_particle.kernels) == 1
+
+    assert numpy.allclose(cached, direct, rtol=1e-12, atol=0)
+    assert numpy.allclose(cached[1:], [integral.integrate(p, integral.F_f) for p in p0[1:]],
+                          rtol=1e-12, atol=0)
+
+
+@with_setup_args(non_equilibium_setup)
+def linearized_integral_test(params, universe):
+
+    params.update(universe.total_energy_density())
+
+    integral = universe.interactions[0].integrals[0]
+    p0 = integral.particle.grid.TEMPLATE
+
+    A, B = integral.linearized(p0)
+    assert numpy.allclose(A, integral.integrate(p0, integral.F_1), rtol=1e-14, atol=0)
+    assert numpy.allclose(B, integral.integrate(p0, integral.F_f), rtol=1e-14, atol=0)
+
+    A, B = integral.linearized(p0[10])
+    assert numpy.shape(A) == numpy.shape(B) == ()
+
+
+@with_setup_args(non_equilibium_setup)
+def collision_jacobian_test(params, universe):
+
+    params.update(universe.total_energy_density())
+
+    neutrino_e = universe.particles[1]
+    grid = neutrino_e.grid.TEMPLATE
+    neutrino_e._distribution = neutrino_e._distribution * (1. + 0.1 * numpy.sin(grid / params.aT))
+    distribution = neutrino_e._distribution.copy()
+
+    integral = universe.interactions[0].integrals[0]
+    assert integral.particle is neutrino_e
+
+    def collision_integral(p):
+        return integral.F_A(p) + integral.F_B(p)
+
+    jacobian = integral.jacobian(grid)
+    assert jacobian.shape == (len(grid), len(grid))
+
+    for j in [0, 10, 25, 40]:
+        step = 1e-4 * distribution[j]
+        neutrino_e._distribution = distribution.copy()
+        neutrino_e._distribution[j] += step
+        forward = integral.integrate(grid, collision_integral)
+        neutrino_e._distribution[j] -= 2 * step
+        backward = integral.integrate(grid, collision_integral)
+
+        assert numpy.allclose((forward - backward) / 2. / step, jacobian[:, j],
+                              rtol=0, atol=1e-6 * numpy.abs(jacobian).max())
+
+    neutrino_e._distribution = distribution
+    assert numpy.allclose(integral.jacobian(grid[10]), jacobian[10], rtol=1e-12, atol=0)
+
+
+def below_threshold_kernel_test():
+    from common import Params
+
+    params = Params(T=0.1 * UNITS.MeV, dy=0.025)
+    neutrino_e = Particle(**SMP.leptons.neutrino_e)
+    electron = Particle(**SMP.leptons.electron)
+    for particle in [neutrino_e, electron]:
+        particle.set_params(params)
+    params.update(neutrino_e.energy_density + electron.energy_density)
+
+    # Annihilation into $e^+ e^-$ is closed for the lowest momenta
+    integral, = [integral for integral
+                 in SMI.neutrinos_to_leptons(neutrino=neutrino_e, lepton=electron).integrals
+                 if all(item.specie is electron for item in integral.reaction[2:])]
+    p0 = neutrino_e.grid.TEMPLATE[:10]
+    assert not len(integral.kernel(p0).weights)
+
+    A, B = integral.linearized(p0)
+    assert A.shape == B.shape == p0.shape
+    assert not A.any() and not B.any()
+
+    A, B = integral.linearized(numpy.array(0.))
+    assert A == B == 0
+
+
+@with_setup_args(non_equilibium_setup)
+def implicit_collisions_fallback_test(params, universe):
+    import warnings
+
+    params.update(universe.total_energy_density())
+    universe.update_particles()
+    universe.init_interactions()
+
+    neutrino_e = universe.particles[1]
+    neutrino_e.implicit_collisions = True
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        integral = neutrino_e.calculate_collision_integral(neutrino_e.grid.TEMPLATE)
+        assert integral.shape == neutrino_e.grid.TEMPLATE.shape
+        assert not caught, "Whole grid should be solved implicitly"
+
+        integral = neutrino_e.calculate_collision_integral(neutrino_e.grid.TEMPLATE[5])
+        assert numpy.shape(integral) == ()
+        assert len(caught) == 1 and issubclass(caught[0].category, RuntimeWarning), \
+            "Fallback to the diagonal solver should be reported"
+
+
+@with_setup_args(setup)
+def massive_kernel_reuse_test(params):
+
+    neutrino_e = Particle(**SMP.leptons.neutrino_e)
+    electron = Particle(**SMP.leptons.electron)
+    for particle in [neutrino_e, electron]:
+        particle.set_params(params)
+    params.update(neutrino_e.energy_density + electron.energy_density)
+
+    integral = SMI.neutrinos_to_leptons(neutrino=neutrino_e, lepton=electron).integrals[0]
+    p0 = neutrino_e.grid.TEMPLATE[::5]
+
+    def exact():
+        return integral.integrate(
+            p0, integral.F_f, bounds=integral.default_bounds(p0[:, numpy.newaxis, numpy.newaxis])
+        )
+
+    # Exact masses by default: the kernel is rebuilt on every call and is not stored
+    assert four_particle.MASS_TOLERANCE == 0
+    four_particle.kernels.clear()
+    kernel = integral.kernel(p0)
+    assert integral.kernel(p0) is not kernel
+    assert not len(four_particle.kernels)
+    assert numpy.allclose(integral.integrate(p0, integral.F_f), exact(), rtol=1e-12, atol=0)
+
+    tolerance = 0.01
+    four_particle.MASS_TOLERANCE = tolerance
+    try:
+        four_particle.kernels.clear()
+        kernel = integral.kernel(p0)
+
+        # Small change of the scale factor reuses the kernel, large one leads to a rebuild
+        params.a *= 1. + tolerance / 1e3
+        assert integral.kernel(p0) is kernel
+        params.a *= 1. + 2 * tolerance
+        assert integral.kernel(p0) is not kernel
+        assert len(four_particle.kernels) == 2
+
+        # Rounding of the masses only slightly affects the integral far from the threshold
+        assert numpy.allclose(integral.integrate(p0, integral.F_f), exact(),
+                              rtol=tolerance, atol=0)
+    finally:
+        four_particle.MASS_TOLERANCE = 0.
+
+
+def threshold_kernel_masses_test():
+    from common import Params
+
+    # Close to the $e^+ e^-$ threshold the integral is sensitive to the electron mass
+    params = Params(T=0.1 * UNITS.MeV, dy=0.025)
+    neutrino_e = Particle(**SMP.leptons.neutrino_e)
+    electron = Particle(**SMP.leptons.electron)
+    for particle in [neutrino_e, electron]:
+        particle.set_params(params)
+    params.update(neutrino_e.energy_density + electron.energy_density)
+
+    integral, = [integral for integral
+                 in SMI.neutrinos_to_leptons(neutrino=neutrino_e, lepton=electron).integrals
+                 if all(item.specie is electron for item in integral.reaction[2:])]
+    p0 = neutrino_e.grid.TEMPLATE
+
+    masses = [item.specie.conformal_mass for item in integral.reaction]
+    exact = integral.integrate(
+        p0, integral.F_f, bounds=integral.default_bounds(p0[:, numpy.newaxis, numpy.newaxis])
+    )
+    assert (exact != 0).any()
+    assert numpy.allclose(integral.integrate(p0, integral.F_f), exact, rtol=1e-12, atol=0)
+
+    # Kernel of slightly shifted masses leads to a much larger error of the integral
+    shifted = [mass * (1. - 0.0034) for mass in masses]
+    integral.quantized_masses = lambda: (('shifted',), shifted)
+    rounded = integral.integrate(p0, integral.F_f)
+    nonzero = exact != 0
+    assert numpy.abs(rounded[nonzero] / exact[nonzero] - 1).max() > 0.05
+
+
+@with_setup_args(setup)
+def kinematic_region_test(params):
+
+    neutrino_e = Particle(**SMP.leptons.neutrino_e)
+    electron = Particle(**SMP.leptons.electron)
+    for particle in [neutrino_e, electron]:
+        particle.set_params(params)
+
+    integral = SMI.neutrinos_to_leptons(neutrino=neutrino_e, lepton=electron).integrals[0]
+    grid = integral.grids[1]
+
+    p0 = neutrino_e.grid.TEMPLATE[::5, numpy.newaxis]
+    p1 = grid.TEMPLATE[::5]
+    upper = numpy.minimum(p0 + p1, grid.MAX_MOMENTUM)
+    start, end = integral.region([p0, p1], grid.MIN_MOMENTUM, upper)
+    assert start.shape == end.shape == (len(p0), len(p1))
+    assert (start >= grid.MIN_MOMENTUM).all() and (end <= upper).all() and (start <= end).all()
+
+    # The whole region is allowed and nothing is allowed right outside of it
+    nonempty = start < end
+    for t in numpy.linspace(0.01, 0.99, 9):
+        assert integral.allowed([p0, p1, start + t * (end - start)])[nonempty].all()
+
+    delta = 1e-6 * (upper - grid.MIN_MOMENTUM)
+    below = start - delta
+    assert not integral.allowed([p0, p1, below])[nonempty & (below > grid.MIN_MOMENTUM)].any()
+    above = end + delta
+    assert not integral.allowed([p0, p1, above])[nonempty & (above < upper)].any()
+
+    # Grid search of the region
+    for p in [grid.TEMPLATE[10], grid.TEMPLATE[-10]]:
+        assert integral.lower_bound(p, p) <= integral.upper_bound(p, p)
+
+
+def narrow_region_test():
+    from common import Params, integrators
+
+    params = Params(T=0.1 * UNITS.MeV, dy=0.025)
+    neutrino_e = Particle(**SMP.leptons.neutrino_e)
+    electron = Particle(**SMP.leptons.electron)
+    for particle in [neutrino_e, electron]:
+        particle.set_params(params)
+    params.update(neutrino_e.energy_density + electron.energy_density)
+
+    # $\nu_e + e \to \nu_e + e$ with the neutrino integrated over: a slow neutrino only gets a\
+    # narrow range of momenta far from both ends of $[p_{min}, p_0 + p_1]$
+    scattering, = [integral for integral
+                   in SMI.neutrinos_to_leptons(neutrino=neutrino_e, lepton=electron).integrals
+                   if [item.specie for item in integral.reaction[:2]] == [neutrino_e, electron]]
+    reaction, Ms = scattering.reaction, copy.deepcopy(scattering.Ms)
+    if reaction[2].specie is electron:
+        reaction = reaction[:2] + reaction[:1:-1]
+        for M in Ms:
+            M.order = tuple({2: 3, 3: 2}.get(i, i) for i in M.order)
+    integral = four_particle.FourParticleIntegral(particle=neutrino_e, reaction=reaction, Ms=Ms)
+
+    # Dense scan of the logarithmic grid of $p_2$ for every $p_1$ node of the kernel
+    quadrature = integrators.quadrature(integral.grids[0].BOUNDS)
+    grid = integral.grids[1]
+    p0 = numpy.array([0.0005, 0.003, 0.009, 0.021]) * params.aT
+    p1 = quadrature.nodes[:, numpy.newaxis]
+    upper = numpy.minimum(p0[:, numpy.newaxis] + quadrature.nodes, grid.MAX_MOMENTUM)
+    p2 = numpy.logspace(-12, 0, 20001) * upper[..., numpy.newaxis]
+
+    start, end = integral.region([p0[:, numpy.newaxis], quadrature.nodes], grid.MIN_MOMENTUM,
+                                 upper)
+    reference = []
+    for p0_i, p2_i, start_i, end_i in zip(p0, p2, start, end):
+        allowed = integral.allowed([p0_i, p1, p2_i])
+        assert allowed.any(axis=-1).all() and (start_i < end_i).all()
+        assert (start_i <= numpy.where(allowed, p2_i, numpy.inf).min(axis=-1)).all()
+        assert (end_i >= numpy.where(allowed, p2_i, -numpy.inf).max(axis=-1)).all()
+
+        values = numpy.trapz(integral.integrand(p0_i, p1, p2_i, integral.F_f), p2_i)
+        reference.append(quadrature.integrate(values))
+    reference = numpy.array(reference) * (params.m / params.x)**5 / 64. / numpy.pi**3
+
+    assert (reference != 0).all()
+    assert numpy.allclose(integral.integrate(p0, integral.F_f), reference, rtol=1e-3, atol=0)
+
+
+@with_setup_args(setup)
+def three_particle_batch_test(params):
+
+    neutrino_e = Particle(**SMP.leptons.neutrino_e)
+    sterile = Particle(**NuP.dirac_sterile_neutrino(mass=200 * UNITS.MeV))
+    neutral_pion = Particle(**SMP.hadrons.neutral_pion)
+    for particle in [neutrino_e, sterile, neutral_pion]:
+        particle.set_params(params)
+
+    integrals = NuI.sterile_pion_neutral(theta=1e-3, sterile=sterile, active=neutrino_e,
+                                         pion=neutral_pion)[0].integrals
+    for integral in integrals:
+        integral.constant = sum(M.K for M in integral.Ms)
+
+        p0 = integral.particle.grid.TEMPLATE[::5]
+        batch = integral.integrate(p0, integral.F_f)
+        assert batch.shape == p0.shape
+        assert numpy.allclose(batch, [integral.integrate(p, integral.F_f) for p in p0],
+                              rtol=1e-12, atol=0)
+        assert batch[0] == integral.rest_integral(integral.F_f)
+        assert (batch[1:] != 0).any()
+
+        A, B = integral.linearized(p0)
+        assert numpy.allclose(A, integral.integrate(p0, integral.F_1), rtol=1e-12, atol=0)
+        assert numpy.allclose(B, batch, rtol=1e-12, atol=0)
+
+
+@with_setup_args(setup)
+def decay_region_test(params):
+
+    neutrino_e = Particle(**SMP.leptons.neutrino_e)
+    sterile = Particle(**NuP.dirac_sterile_neutrino(mass=200 * UNITS.MeV))
+    neutral_pion = Particle(**SMP.hadrons.neutral_pion)
+    for particle in [neutrino_e, sterile, neutral_pion]:
+        particle.set_params(params)
+
+    integrals = NuI.sterile_pion_neutral(theta=1e-3, sterile=sterile, active=neutrino_e,
+                                         pion=neutral_pion)[0].integrals
+    for integral in integrals:
+        integral.constant = sum(M.K for M in integral.Ms)
+        grid = integral.grids[0]
+
+        p0 = integral.particle.grid.TEMPLATE[1::10]
+        start, end = integral.region([p0], grid.MIN_MOMENTUM, grid.MAX_MOMENTUM)
+
+        # The allowed region found by the dense scan of the kinematic conditions
+        p1 = numpy.linspace(grid.MIN_MOMENTUM, grid.MAX_MOMENTUM, 100001)
+        for p0_i, start_i, end_i in zip(p0, start, end):
+            allowed = p1[integral.allowed([p0_i, p1])]
+            if not len(allowed):
+                assert start_i == end_i
+                continue
+            assert abs(allowed[0] - start_i) <= p1[1] and abs(allowed[-1] - end_i) <= p1[1]
+
+        nonempty = start < end
+        constant = params.a / 16. / numpy.pi
+        exact = [
+            constant * integrate.quad(
+                lambda p: integral.integrand(p0_i, numpy.array([p]), integral.F_f)[0],
+                start_i, end_i, epsrel=1e-10
+            )[0]
+            for p0_i, start_i, end_i in zip(p0[nonempty], start[nonempty], end[nonempty])
+        ]
+        assert numpy.allclose(integral.integrate(p0[nonempty], integral.F_f), exact,
+                              rtol=1e-8, atol=0)
+
+
+def lru_cache_budget_test():
+
+    cache = LRUCache(budget=3, sizeof=len)
+    cache['a'] = 'x'
+    cache['b'] = 'yy'
+    assert cache.size == 3
+
+    cache.get('a')
+    cache['c'] = 'z'
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+
+    cache['d'] = 'long'
+    assert 'd' not in cache and cache.size == 2
@@ -128,3 +128,110 @@ def neutron_lifetime_test():
 
     assert adaptive_result - fixed_result < error, "Gauss-Legendre quadrature order is insufficient"
     assert adaptive_result - own_result < error, "Own integrator is inaccurate"
+
+
+def resample_history_test():
+    poly = lambda t: 1. + 2. * t - 0.5 * t**2 + 0.1 * t**3
+    h_old, h_new = 0.1, 0.17
+    history = [poly(-h_old * i) for i in range(4, 0, -1)]
+    resampled = integrators.resample_history(history, h_old, h_new)
+    expected = [poly(-h_new * i) for i in range(4, 0, -1)]
+
+    assert numpy.allclose(resampled, expected, rtol=1e-12), \
+        "Cubic history should be resampled exactly"
+
+
+def multistep_history_test():
+    poly = lambda t: 1. + 2. * t - 0.5 * t**2 + 0.1 * t**3
+    antiderivative = lambda t: t + t**2 - t**3 / 6. + 0.025 * t**4
+
+    # Variable steps between the derivatives, the last one at $t = 0$
+    steps = [0.1, 0.07, 0.13]
+    ts = numpy.cumsum([0.] + steps) - sum(steps)
+
+    history = integrators.MultistepHistory(3)
+    for t, step in zip(ts, [0.] + steps):
+        history.append([poly(t), 2 * poly(t)], step)
+
+    assert len(history) == 3, "History should be bounded"
+    assert numpy.allclose(list(history), [[poly(t), 2 * poly(t)] for t in ts[1:]], rtol=1e-14)
+
+    h = 0.2
+    exact = antiderivative(h) - antiderivative(0.)
+    assert numpy.allclose(integrators.adams_bashforth_correction(history, h, order=3, index=[0]),
+                          exact, rtol=0.05)
+    assert numpy.allclose(integrators.adams_moulton_solver(0., history, poly(h), 0., h, order=4,
+                                                           index=0),
+                          exact, rtol=1e-12), "Cubic should be integrated exactly"
+
+    # Equally spaced history reproduces the fixed coefficients
+    fs = [poly(-0.1 * i) for i in range(3, -1, -1)]
+    assert abs(integrators.adams_bashforth_correction(fs, 0.1, steps=[0.1] * 3)
+               - integrators.adams_weights([-0.3, -0.2, -0.1, 0.], 0.1).dot(fs) * 0.1) < 1e-14
+    assert abs(integrators.adams_bashforth_correction(fs, 0.1) - antiderivative(0.1)) \
+        < 1e-13
+
+
+def linearly_implicit_adams_moulton_test():
+    y = numpy.array([1., 0.5, 0.2])
+    fs = [numpy.array([0.1, -0.2, 0.3]), numpy.array([0.2, -0.1, 0.1])]
+    A = numpy.array([1., 2., 3.])
+    B = numpy.array([-10., -200., -3000.])
+
+    diagonal = integrators.adams_moulton_solver(y, fs, A, B, 0.1, order=3)
+    implicit = integrators.linearly_implicit_adams_moulton_solver(y, fs, A + B * y, numpy.diag(B),
+                                                                  0.1, order=3)
+    assert numpy.allclose(implicit, diagonal, rtol=1e-14, atol=0), \
+        "Diagonal Jacobian should reproduce the linearized solver"
+
+    # Linear system $dy/dt = J y$ is solved exactly by the implicit Euler step
+    J = numpy.array([[-100., 90., 0.], [90., -100., 10.], [0., 10., -20.]])
+    implicit = integrators.linearly_implicit_adams_moulton_solver(y, [], J.dot(y), J, 0.1, order=1)
+    assert numpy.allclose(implicit, numpy.linalg.solve(numpy.eye(3) - 0.1 * J, y), rtol=1e-14)
+
+
+def step_controller_test():
+    controller = integrators.StepController(tolerance=1e-4)
+
+    assert controller.propose(0.1, 1e-2, 4) < 0.1, "Step should shrink when error is too large"
+    assert controller.propose(0.1, 0.8e-4, 4) == 0.1, "Step should hold within hysteresis"
+    assert controller.propose(0.05, 1e-8, 4) <= 0.1, "Step growth should be bounded"
+
+
+def quadrature_test():
+    quadrature = integrators.quadrature((0., 10.))
+    assert integrators.quadrature((0., 10.)) is quadrature, "Quadratures should be reused"
+
+    grid = numpy.linspace(0, 8, 17) ** 1.2
+    values = numpy.cos(grid)
+    assert numpy.allclose(numpy.dot(quadrature.interpolation(grid), values),
+                          numpy.interp(quadrature.nodes, grid, values), rtol=1e-14, atol=1e-14)
+    assert abs(numpy.dot(quadrature.grid_weights(grid), values)
+               - quadrature.integrate(numpy.interp(quadrature.nodes, grid, values))) < 1e-12
+
+    # Triangle $0 < y < x < 10$
+    x, y, w = quadrature.transform(lambda x: 0., lambda x: x)
+    assert abs(numpy.sum(w * x * y) - 10.**4 / 8) < 1e-9
+
+
+def gauss_kronrod_test():
+    # Kink at $x = 0.3$ and a narrow peak at $x = 0.7$
+    f = lambda x: numpy.sqrt(numpy.abs(x - 0.3)) + 1. / (1e-3 + (x - 0.7)**2)
+    exact = integrate.quad(f, 0., 1., points=[0.3, 0.7], epsabs=0, epsrel=1e-13, limit=500)[0]
+
+    fixed, error = integrators.integrate_1D(f, (0., 1.), tolerance=0)
+    assert numpy.isnan(error)
+
+    for tolerance in [1e-4, 1e-8]:
+        integral, error = integrators.integrate_1D(f, (0., 1.), tolerance=tolerance,
+                                                   points=(0.3,))
+        assert abs(integral - exact) <= error <= tolerance * abs(integral)
+        assert abs(integral - exact) < abs(fixed - exact)
+
+    g = lambda x, y: numpy.exp(-x * y) * numpy.sqrt(y)
+    h = lambda x: min(x + 1., 2.)
+    exact = integrate.dblquad(lambda y, x: g(x, y), 0., 2., lambda x: 0., h,
+                              epsabs=0, epsrel=1e-12)[0]
+    integral, error = integrators.integrate_2D(g, ((0., 2.), (lambda x: 0., h)),
+                                               tolerance=1e-8, points=(1.,))
+    assert abs(integral - exact) <= error <= 1e-8 * abs(integral)
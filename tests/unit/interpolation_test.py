@@ -1,5 +1,7 @@
 import numpy
+from nose.plugins.skip import SkipTest
 
+from common import GRID
 from particles import Particle
 from library.SM import particles as SMP
 
@@ -36,3 +38,43 @@ def distribution_interpolation_accuracy_test(params):
         neutrino.equilibrium_distribution_function(detailed_grid / neutrino.aT)
         - numpy.vectorize(neutrino.distribution)(detailed_grid)
     ) < 1e-9)
+
+
+@with_setup_args(setup)
+def distribution_array_test(params):
+
+    neutrino = Particle(params=params, **SMP.leptons.neutrino_e)
+    neutrino._distribution = neutrino._distribution * (1 + 0.1 * numpy.sin(neutrino.grid.TEMPLATE))
+
+    momenta = numpy.linspace(-neutrino.grid.MAX_MOMENTUM, neutrino.grid.MAX_MOMENTUM * 2, num=1000)
+    momenta = numpy.concatenate([momenta, neutrino.grid.TEMPLATE])
+
+    values = neutrino.distribution_array(momenta)
+
+    assert all(values == [neutrino.distribution(p) for p in momenta])
+    assert all(values[-neutrino.grid.MOMENTUM_SAMPLES:] == neutrino._distribution)
+    assert values.reshape(2, -1).shape == neutrino.distribution_array(momenta.reshape(2, -1)).shape
+
+
+def compiled_interpolation_test():
+
+    try:
+        from particles.interpolation import interpolation
+    except ImportError:
+        raise SkipTest("Interpolation extension is not built")
+    from particles.interpolation import numpy_interpolation
+
+    grid = GRID.TEMPLATE
+    momenta = numpy.random.RandomState(0).uniform(-1, grid[-1] * 1.2, size=1000)
+    momenta = numpy.concatenate([momenta, grid])
+
+    for eta in [1., -1.]:
+        distribution = 1. / (numpy.exp(grid) + eta) * (1 + 0.1 * numpy.sin(grid))
+        for mass in [0., 1.]:
+            for exponential in [True, False]:
+                assert all(
+                    interpolation.distribution_interpolation(grid, distribution, momenta,
+                                                             mass, eta, exponential)
+                    == numpy_interpolation.distribution_interpolation(grid, distribution, momenta,
+                                                                      mass, eta, exponential)
+                )
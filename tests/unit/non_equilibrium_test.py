@@ -28,3 +28,130 @@ def free_non_equilibrium_test(params, universe):
         "Interacting particle distribution changed"
     assert all(neutrino_mu._distribution == neutrino_mu_distribution),\
         "Free particle distribution changed"
+
+
+@with_setup_args(non_equilibium_setup)
+def checkpoint_resume_test(params, universe):
+    import os
+    import numpy
+    import tempfile
+
+    params.update(universe.total_energy_density())
+    universe.update_particles()
+    universe.save_params()
+
+    photon, neutrino_e, neutrino_mu = universe.particles
+    neutrino_e._distribution = neutrino_e._distribution * 1.1
+    distribution = neutrino_e._distribution.copy()
+    aT = params.aT
+
+    for _ in range(3):
+        neutrino_e.save_snapshot()
+
+    path = universe.checkpoint(os.path.join(tempfile.mkdtemp(), 'checkpoint.pickle'))
+
+    neutrino_e._distribution = neutrino_e._distribution * 2
+    params.aT *= 2
+    universe.step += 1
+    universe.save_params()
+
+    universe.resume(path)
+
+    assert universe.step == 1 and len(universe.history) == 1, "Universe state is not restored"
+    assert params.aT == aT, "Cosmological parameters are not restored"
+    assert numpy.array_equal(neutrino_e._distribution, distribution), \
+        "Particle distribution is not restored"
+    assert neutrino_e.params is params, "Particle should keep the shared parameters"
+
+    # Calculation set up anew by the same script
+    (params, universe), _ = non_equilibium_setup()
+    universe.resume(path)
+
+    photon, neutrino_e, neutrino_mu = universe.particles
+    assert universe.step == 1 and len(universe.history) == 1, "Universe state is not restored"
+    assert params.aT == aT, "Cosmological parameters are not restored"
+    assert numpy.array_equal(neutrino_e._distribution, distribution), \
+        "Particle distribution is not restored"
+    assert neutrino_e.params is params, "Particle should keep the shared parameters"
+    assert len(neutrino_e.data['distribution']) == 1, "Checkpoint should keep the last snapshot"
+    assert numpy.array_equal(neutrino_e.data['distribution'][0], distribution)
+
+
+@with_setup_args(non_equilibium_setup)
+def streamed_snapshots_resume_test(params, universe):
+    import os
+    import numpy
+    import tempfile
+    from common import utils
+
+    def stream(universe):
+        universe.folder = folder
+        universe.STREAM_SNAPSHOTS = True
+        universe.open_snapshot_files()
+        return universe.particles[1]
+
+    folder = tempfile.mkdtemp()
+    params.update(universe.total_energy_density())
+    universe.update_particles()
+    universe.save_params()
+
+    neutrino_e = stream(universe)
+    snapshots = [neutrino_e._distribution]
+    for _ in range(3):
+        neutrino_e._distribution = neutrino_e._distribution * 1.1
+        neutrino_e.save_snapshot()
+        snapshots.append(neutrino_e._distribution)
+
+    path = universe.checkpoint(os.path.join(folder, 'checkpoint.pickle'))
+
+    # Snapshots after the checkpoint are superseded by the resumed calculation
+    for _ in range(2):
+        neutrino_e._distribution = neutrino_e._distribution * 2
+        neutrino_e.save_snapshot()
+
+    (params, universe), _ = non_equilibium_setup()
+    universe.resume(path)
+    neutrino_e = stream(universe)
+    neutrino_e._distribution = neutrino_e._distribution * 1.5
+    neutrino_e.save_snapshot()
+    snapshots.append(neutrino_e._distribution)
+    neutrino_e.snapshot_file.close()
+
+    data = utils.read_history(neutrino_e.snapshot_file.path)
+    assert numpy.array_equal(data.values, snapshots), "Snapshot history is not preserved"
+
+
+@with_setup_args(non_equilibium_setup)
+def bounded_history_test(params, universe):
+
+    params.update(universe.total_energy_density())
+
+    photon, neutrino_e, neutrino_mu = universe.particles
+    neutrino_e.snapshot_freq = 2
+
+    for _ in range(6):
+        universe.update_particles()
+        universe.init_interactions()
+        universe.calculate_collisions()
+        universe.update_distributions()
+
+    assert len(neutrino_e.data['collision_integral']) == neutrino_e.SOLVER_HISTORY, \
+        "Solver history should be bounded"
+    assert len(neutrino_e.data['distribution']) == 1 + 6 // 2, \
+        "Distribution snapshots should be decimated"
+
+
+def non_equilibrium_moments_test():
+    from common import Params
+    from particles import Particle, REGIMES
+    from library.SM import particles as SMP
+
+    params = Params(T=SMP.leptons.neutrino_e['decoupling_temperature'] / 2, dy=0.025)
+    neutrino = Particle(params=params, **SMP.leptons.neutrino_e)
+    assert neutrino.regime == REGIMES.NONEQ
+
+    for name in ['density', 'energy_density', 'pressure']:
+        value = getattr(REGIMES.NONEQ, name)(neutrino)
+        expected = getattr(REGIMES.RADIATION, name)(neutrino)
+        assert abs(value / expected - 1) < 5e-3, \
+            "Non-equilibrium {} of the equilibrium distribution is inaccurate".format(name)
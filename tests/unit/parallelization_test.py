@@ -0,0 +1,96 @@
+import numpy
+from . import non_equilibium_setup, with_setup_args
+from common import parallelization
+
+
+@with_setup_args(non_equilibium_setup)
+def shared_state_test(params, universe):
+
+    params.update(universe.total_energy_density())
+
+    photon, neutrino_e, neutrino_mu = universe.particles
+    neutrino_e._distribution = (neutrino_e._distribution
+                                * (1 + 0.1 * numpy.sin(neutrino_e.grid.TEMPLATE)))
+    universe.update_particles()
+    universe.init_interactions()
+
+    serial = neutrino_e.integrate_collisions()
+
+    state = parallelization.SharedState(params, universe.particles, universe.interactions)
+    state.publish()
+
+    tasks = state.schedule([neutrino_e])
+    assert all(isinstance(task[1], int) for task in tasks)
+    assert sum(len(task[3]) for task in tasks) == neutrino_e.grid.MOMENTUM_SAMPLES
+
+    # Simulate the worker copy of the objects that is out of date
+    distribution = neutrino_e._distribution
+    state.bind()
+    params.a = 0.
+
+    results = [state.integrate(task) for task in tasks]
+    assert all(neutrino_e._distribution == distribution)
+
+    A, B = state.gather(tasks, results)[state.particles.index(neutrino_e)]
+    shared = neutrino_e.solve_collision_integral(neutrino_e.grid.TEMPLATE, A, B)
+    assert numpy.allclose(shared, serial, rtol=1e-10, atol=0)
+
+    # Worker reloads the state only when a new version is published
+    version = state.version
+    params.a = 0.
+    state.integrate(tasks[0])
+    assert params.a == 0. and state.version == version
+
+    assert state.describes(universe.particles, universe.interactions)
+    assert not state.describes(universe.particles[:-1], universe.interactions)
+
+
+@with_setup_args(non_equilibium_setup)
+def schedule_balance_test(params, universe):
+
+    params.update(universe.total_energy_density())
+
+    photon, neutrino_e, neutrino_mu = universe.particles
+    universe.update_particles()
+    universe.init_interactions()
+
+    state = parallelization.SharedState(params, universe.particles, universe.interactions)
+    integral = state.integrals.index(neutrino_e.collision_integrals[0])
+
+    # Momenta are split into work items of similar cost, largest items come first
+    tasks = state.schedule([neutrino_e])
+    sizes = [len(task[3]) for task in tasks]
+    assert sizes == sorted(sizes, reverse=True)
+    assert len(tasks) >= min(neutrino_e.grid.MOMENTUM_SAMPLES,
+                             parallelization.worker_count * state.ITEMS_PER_WORKER)
+
+    # Measured costs of unknown integrals default to the average of the known ones
+    state.costs = {integral: 2., integral + 1: 4.}
+    assert state.cost(integral) == 2. and state.cost(integral + 2) == 3.
+
+
+@with_setup_args(non_equilibium_setup)
+def shared_density_state_test(params, universe):
+    from particles import DensityParticle
+    from library.SM import particles as SMP
+
+    params.update(universe.total_energy_density())
+
+    # Decoupled particle state is set directly: `DensityParticle.update` needs the thermodynamics\
+    # methods of the regimes that it does not have
+    neutron = DensityParticle(**SMP.hadrons.neutron)
+    neutron.params, neutron.T, neutron.aT = params, params.T, params.aT
+    universe.particles.append(neutron)
+    neutron._density = 1e-3 * params.aT**3
+    neutron.compute_chemical_potential()
+    published = (neutron.T, neutron.aT, neutron._density, neutron.mu)
+
+    state = parallelization.SharedState(params, universe.particles, universe.interactions)
+    assert state.density_particles == [neutron] and neutron not in state.particles
+    state.publish()
+
+    # Simulate the worker copy of the particle that is out of date
+    state.bind()
+    neutron.T, neutron.aT, neutron._density, neutron.mu = 0., 0., 0., 0.
+    state.load()
+    assert (neutron.T, neutron.aT, neutron._density, neutron.mu) == published
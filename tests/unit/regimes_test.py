@@ -152,3 +152,74 @@ def smooth_decoupling_test(params):
     assert neutrino.pressure() - pressure < eps
     assert neutrino.numerator() - numerator < eps
     assert neutrino.denominator() - denominator < eps
+
+
+@with_setup_args(setup)
+def intermediate_moments_test(params):
+    from common import integrators
+    from particles import IntermediateParticle
+
+    electron = Particle(params=params, **SMP.leptons.electron)
+    muon = Particle(params=params, **SMP.leptons.muon)
+    bounds = (electron.grid.MIN_MOMENTUM / params.a, electron.grid.MAX_MOMENTUM / params.a)
+
+    quadrature = IntermediateParticle.quadrature_moments([electron, muon], [params.aT] * 2)
+    batched = IntermediateParticle.moments([electron, muon])
+
+    for i, (particle, cached) in enumerate(zip([electron, muon], batched)):
+        moments = {key: value[i] for key, value in quadrature.items()}
+        energy_density, _ = integrators.integrate_1D(
+            lambda p: IntermediateParticle.energy_density_integrand(p, particle), bounds)
+        pressure, _ = integrators.integrate_1D(
+            lambda p: IntermediateParticle.pressure_integrand(p, particle), bounds)
+
+        assert abs(moments['energy_density'] / energy_density - 1) < 1e-12
+        assert abs(moments['pressure'] / pressure - 1) < 1e-12
+        assert IntermediateParticle.energy_density(particle) == cached['energy_density'], \
+            "Batched moments should be reused"
+
+    # Dust regime only needs the integrals of the temperature equation
+    dust, = IntermediateParticle.moments([muon], aT=2 * params.aT, names=('I2', 'I4'))
+    assert sorted(dust) == ['I2', 'I4']
+    full, = IntermediateParticle.moments([muon], aT=2 * params.aT)
+    assert all(dust[name] == full[name] for name in dust)
+
+
+def thermodynamic_tables_test():
+    import tempfile
+    import numpy
+    from scipy import integrate
+    from particles import tables
+
+    folder, tables.FOLDER = tables.FOLDER, tempfile.mkdtemp()
+    try:
+        table = tables.ThermodynamicTable(1.)
+        assert tables.ThermodynamicTable(1.).load(tables.grid()) is not None, \
+            "Table should be saved to disk"
+    finally:
+        tables.FOLDER = folder
+
+    # Integrands of `tables.FUNCTIONS` for fermions
+    def f(u, z):
+        exponent = numpy.exp(-numpy.sqrt(u**2 + z**2))
+        return exponent / (1. + exponent)
+
+    def df(u, z):
+        exponent = numpy.exp(-numpy.sqrt(u**2 + z**2))
+        return exponent / (exponent + 1.)**2
+
+    integrands = {
+        'density': lambda u, z: u**2 * f(u, z),
+        'energy_density': lambda u, z: u**2 * numpy.sqrt(u**2 + z**2) * f(u, z),
+        'pressure': lambda u, z: u**4 / numpy.sqrt(u**2 + z**2) * f(u, z) / 3.,
+        'I2': lambda u, z: u**2 * df(u, z),
+        'I4': lambda u, z: u**4 * df(u, z)
+    }
+
+    for z in [1e-3, 0.137, 1.2345, 7.77, 42.4242]:
+        interpolated = table(z)
+        for name in tables.FUNCTIONS:
+            expected, _ = integrate.quad(integrands[name], 0, numpy.inf, args=(z,),
+                                         epsabs=0, epsrel=1e-12, limit=200)
+            assert abs(interpolated[name] / expected - 1) < 2e-9, \
+                "Interpolated {} is inaccurate at z = {}".format(name, z)
@@ -0,0 +1,59 @@
+import numpy
+
+from common import utils
+
+
+def history_test():
+    history = utils.History(('a', 'b'), capacity=1)
+
+    for i in range(10):
+        history.append({'a': i, 'b': 2 * i})
+    history.append({'a': 10})
+
+    assert len(history) == 11
+    assert numpy.array_equal(history['a'], numpy.arange(11))
+    assert numpy.array_equal(history['b'][:-1], 2 * numpy.arange(10))
+    assert numpy.isnan(history.last()[1]), "Missing values should be filled with nan"
+
+    frame = history.frame()
+    assert list(frame.columns) == ['a', 'b']
+    assert frame['a'].iloc[-1] == 10
+
+
+def history_file_test():
+    import os
+    import tempfile
+
+    history = utils.History(('a', 'b'))
+    path = os.path.join(tempfile.mkdtemp(), 'evolution.history')
+    history_file = utils.HistoryFile(path, history.columns, flush_freq=2)
+
+    for i in range(5):
+        history.append({'a': i, 'b': -i})
+        history_file.write(history)
+
+    assert len(utils.read_history(path)) == 4, "Records should be flushed every 2 writes"
+
+    history_file.close()
+    with open(path, 'ab') as f:
+        f.write('\0' * 4)
+
+    data = utils.read_history(path)
+    assert data.equals(history.frame()), "Incomplete records should be ignored"
+
+
+def history_file_reopen_test():
+    import os
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), 'distribution.history')
+    history_file = utils.HistoryFile(path, ('a', 'b'))
+    history_file.append([1., 2.])
+    history_file.close()
+
+    # Continued calculation appends to the closed file
+    history_file.append([3., 4.])
+    history_file.close()
+
+    data = utils.read_history(path)
+    assert numpy.array_equal(data.values, [[1., 2.], [3., 4.]])